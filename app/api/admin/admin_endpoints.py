@@ -1,84 +1,300 @@
-from typing import Annotated
+import asyncio
+import csv
+import io
+from datetime import datetime, timedelta
+from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import EmailStr
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from pydantic import EmailStr, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.auth.auth_endpoints import register_new_user
-from app.api.depends.depends import get_current_user
-from app.api.models import AdminModel, UserModel
-from app.core.config.config import HTTP_BEARER
-from app.core.database.crud import UserCrud, ScoreCrud
+from app.api.depends.depends import ahash, get_current_user, get_current_user_detached, get_session, request_csv_records, request_lines
+from app.api.models import (AdminModel, AnalyticsModel, PaymentsTotalModel, ScoreModel, UserModel, UserPageModel,
+                            UserScoreModel, UserImportModel, UserImportErrorModel, UserImportResultModel)
+from app.core.analytics.analytics import build_report
+from app.core.cache.cache import balance_cache, principal_cache, token_cache
+from app.core.config.config import HTTP_BEARER, engine, replica_router, session_maker
+from app.core.database.crud import InboxCrud, PaymentCrud, UserCrud, ScoreCrud
+from app.core.queue.queue import webhook_workers
+from app.core.security.hashing import hashing_service
+from app.core.security.ratelimit import login_rate_limiter
+from app.core.security.revocation import token_revocations
 
 router = APIRouter(tags=['Admin'], prefix='/admins', dependencies=[Depends(HTTP_BEARER)])
 
+EXPORT_CHUNK_BYTES = 64 * 1024
+ANALYTICS_MAX_PERIOD = timedelta(days=366)
+
 
 @router.get('/get_user_with_scores')
-async def get_user_scores(email: EmailStr, admin: Annotated[AdminModel, Depends(get_current_user)]) -> dict | None:
+async def get_user_scores(email: EmailStr, admin: Annotated[AdminModel, Depends(get_current_user)],
+                          session: Annotated[AsyncSession, Depends(get_session)]) -> list[ScoreModel]:
     """Получить список счетов с балансами пользователя"""
     if admin.role != 'admin':
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
-    return await ScoreCrud.get_user_scores(email=email)
+    return await ScoreCrud.get_user_scores(session, email=email)
 
 
 @router.get('/get_all_users')
-async def get_all_users(admin: Annotated[AdminModel, Depends(get_current_user)]) -> list[UserModel]:
-    """Получить список пользователей"""
+async def get_all_users(admin: Annotated[AdminModel, Depends(get_current_user)],
+                        session: Annotated[AsyncSession, Depends(get_session)],
+                        after_id: int | None = None,
+                        limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+                        role: str | None = None,
+                        state: bool | None = None,
+                        email_prefix: str | None = None
+                        ) -> UserPageModel:
+    """Получить страницу пользователей, для следующей страницы передать next_cursor в after_id"""
+    if admin.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
+    return await UserCrud.get_users_page(session, after_id=after_id, limit=limit, role=role,
+                                         state=state, email_prefix=email_prefix)
+
+
+@router.get('/get_all_users_ndjson')
+async def get_all_users_ndjson(admin: Annotated[AdminModel, Depends(get_current_user_detached)],
+                               role: str | None = None,
+                               state: bool | None = None,
+                               email_prefix: str | None = None
+                               ) -> StreamingResponse:
+    """Выгрузить всех пользователей потоком NDJSON (одна строка - один пользователь)"""
+    if admin.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
+
+    async def lines():
+        async for user in UserCrud.stream_users(role=role, state=state, email_prefix=email_prefix):
+            yield user.model_dump_json() + '\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
+@router.get('/export_users')
+async def export_users(admin: Annotated[AdminModel, Depends(get_current_user_detached)],
+                       file_format: Annotated[Literal['csv', 'ndjson'], Query(alias='format')] = 'ndjson'
+                       ) -> StreamingResponse:
+    """Выгрузить пользователей со счетами потоком CSV или NDJSON, строка на каждый счет"""
     if admin.role != 'admin':
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
-    return await UserCrud.get_all_users()
+
+    async def ndjson_lines():
+        async for row in UserCrud.stream_users_with_scores():
+            yield row.model_dump_json() + '\n'
+
+    async def csv_lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(UserScoreModel.model_fields)
+        async for row in UserCrud.stream_users_with_scores():
+            writer.writerow(row.model_dump().values())
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    if file_format == 'csv':
+        return StreamingResponse(csv_lines(), media_type='text/csv')
+    return StreamingResponse(ndjson_lines(), media_type='application/x-ndjson')
+
+
+@router.post('/import_users')
+async def import_users(request: Request,
+                       admin: Annotated[AdminModel, Depends(get_current_user_detached)],
+                       file_format: Annotated[Literal['csv', 'ndjson'], Query(alias='format')] = 'ndjson',
+                       batch_size: Annotated[int, Query(ge=1, le=10_000)] = 1000
+                       ) -> UserImportResultModel:
+    """
+    Импорт пользователей из потока CSV (первая строка - заголовок) или NDJSON, поля как в UserImportModel.
+    Каждая пачка вставляется своей транзакцией, поэтому при ошибке уже вставленные пачки остаются.
+    Вернет количество созданных пользователей и ошибки по строкам.
+    """
+    if admin.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
+
+    created = 0
+    errors: list[UserImportErrorModel] = []
+    batch: list[tuple[int, UserImportModel]] = []
+    header = None
+    records = request_lines(request) if file_format == 'ndjson' else request_csv_records(request)
+    async for line_number, line in records:
+        try:
+            if file_format == 'ndjson':
+                row = UserImportModel.model_validate_json(line)
+            elif header is None:
+                header = next(csv.reader(io.StringIO(line.decode('utf-8-sig'), newline='')))
+                continue
+            else:
+                values = next(csv.reader(io.StringIO(line.decode(), newline='')))
+                row = UserImportModel.model_validate({key: value for key, value in zip(header, values) if value})
+        except ValidationError as error:
+            errors.append(UserImportErrorModel(line=line_number, error='; '.join(
+                ': '.join(filter(None, ['.'.join(map(str, detail['loc'])), detail['msg']]))
+                for detail in error.errors())))
+            continue
+        except (ValueError, csv.Error) as error:
+            errors.append(UserImportErrorModel(line=line_number, error=str(error)))
+            continue
+        batch.append((line_number, row))
+        if len(batch) >= batch_size:
+            created += await _import_users_batch(batch, errors)
+            batch = []
+    if batch:
+        created += await _import_users_batch(batch, errors)
+    errors.sort(key=lambda error: error.line)
+    return UserImportResultModel(created=created, errors=errors)
+
+
+async def _import_users_batch(batch: list[tuple[int, UserImportModel]],
+                              errors: list[UserImportErrorModel]
+                              ) -> int:
+    """
+    Захеширует пароли пачки параллельно в пуле хеширования, затем вставит пачку отдельной транзакцией.
+    Пока считается bcrypt, транзакция не открыта и соединение лежит в пуле.
+    """
+    hashes = iter(await asyncio.gather(*(hashing_service.hash(row.password)
+                                         for _, row in batch if row.password_hash is None)))
+    # строки уже провалидированы UserImportModel, повторная проверка email заметно дороже вставки
+    users = [UserModel.model_construct(email=row.email, first_name=row.first_name, last_name=row.last_name,
+                                       password=row.password_hash or next(hashes), state=row.state, role=row.role)
+             for _, row in batch]
+    async with session_maker.begin() as session:
+        statuses = await UserCrud.create_users_batch(session, users)
+    for (line_number, row), user_status in zip(batch, statuses):
+        if user_status != 'created':
+            errors.append(UserImportErrorModel(line=line_number, email=row.email, error=user_status))
+    return statuses.count('created')
 
 
 @router.post('/create_user')
 async def create_user(user: Annotated[UserModel, Depends()],
-                      admin: Annotated[AdminModel, Depends(get_current_user)]
+                      admin: Annotated[AdminModel, Depends(get_current_user)],
+                      session: Annotated[AsyncSession, Depends(get_session)]
                       ) -> dict[str, str]:
     """Создаст нового пользователя"""
     if admin.role != 'admin':
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
-    return await register_new_user(user=user)
+    return await register_new_user(user=user, session=session)
 
 
 @router.delete('/delete_user_by_id')
-async def delete_user_by_id(user_id: int, admin: Annotated[AdminModel, Depends(get_current_user)]) -> dict[str, str]:
+async def delete_user_by_id(user_id: int, admin: Annotated[AdminModel, Depends(get_current_user)],
+                            session: Annotated[AsyncSession, Depends(get_session)]) -> dict[str, str]:
     """Удалит пользователя по id"""
     if admin.role != 'admin':
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
-    return await UserCrud.delete_user_by_id(user_id=user_id)
+    return await UserCrud.delete_user_by_id(session, user_id=user_id)
 
 
 @router.put('/update_user')
 async def update_user(user_id: int, new_user: Annotated[UserModel, Depends()],
-                      admin: Annotated[AdminModel, Depends(get_current_user)]) -> dict[str, str] | None:
+                      admin: Annotated[AdminModel, Depends(get_current_user)],
+                      session: Annotated[AsyncSession, Depends(get_session)]) -> dict[str, str] | None:
     """Полностью обновит пользователя"""
     if admin.role != 'admin':
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
-    return await UserCrud.update_user(user_id=user_id, new_user=new_user)
+    new_user.password = await ahash(new_user.password)
+    return await UserCrud.update_user(session, user_id=user_id, new_user=new_user)
 
 
 @router.patch('/update_email')
 async def update_user_email(new_email: EmailStr, old_email: EmailStr,
-                            admin: Annotated[AdminModel, Depends(get_current_user)]) -> dict[str, str] | None:
+                            admin: Annotated[AdminModel, Depends(get_current_user)],
+                            session: Annotated[AsyncSession, Depends(get_session)]) -> dict[str, str] | None:
     """Обновит email пользователя"""
     if admin.role != 'admin':
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
-    return await UserCrud.patch_email_user_for_admin(new_email=new_email, old_email=old_email)
+    return await UserCrud.patch_email_user_for_admin(session, new_email=new_email, old_email=old_email)
 
 
 @router.patch('/disable_user')
 async def disable_user(email: EmailStr,
-                       admin: Annotated[AdminModel, Depends(get_current_user)]
+                       admin: Annotated[AdminModel, Depends(get_current_user)],
+                       session: Annotated[AsyncSession, Depends(get_session)]
                        ) -> dict[str, str] | None:
     """Заблокирует пользователя"""
     if admin.role != 'admin':
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
-    return await UserCrud.disable_user(email=email)
+    return await UserCrud.disable_user(session, email=email)
 
 
 @router.patch('/enable_user')
 async def enable_user(email: EmailStr,
-                      admin: Annotated[AdminModel, Depends(get_current_user)]
+                      admin: Annotated[AdminModel, Depends(get_current_user)],
+                      session: Annotated[AsyncSession, Depends(get_session)]
                       ) -> dict[str, str] | None:
     """Разблокирует пользователя"""
     if admin.role != 'admin':
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
-    return await UserCrud.enable_user(email=email)
+    return await UserCrud.enable_user(session, email=email)
+
+
+@router.get('/get_payments_total')
+async def get_payments_total(admin: Annotated[AdminModel, Depends(get_current_user)],
+                             session: Annotated[AsyncSession, Depends(get_session)],
+                             date_from: Annotated[datetime | None, Query(alias='from')] = None,
+                             date_to: Annotated[datetime | None, Query(alias='to')] = None,
+                             score_id: int | None = None
+                             ) -> PaymentsTotalModel:
+    """Сумма и число платежей всех пользователей за период [from, to)"""
+    if admin.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
+    return await PaymentCrud.get_payments_total(session, date_from=date_from, date_to=date_to, score_id=score_id)
+
+
+@router.get('/get_analytics')
+async def get_analytics(admin: Annotated[AdminModel, Depends(get_current_user)],
+                        session: Annotated[AsyncSession, Depends(get_session)],
+                        date_from: Annotated[datetime | None, Query(alias='from')] = None,
+                        date_to: Annotated[datetime | None, Query(alias='to')] = None,
+                        top: Annotated[int, Query(ge=0, le=1000)] = 10
+                        ) -> AnalyticsModel:
+    """
+    Аналитика по всем счетам и платежам: обязательства, перцентили балансов, топ счетов,
+    объем платежей по часам и дням, доля повторных и неуспешных вебхуков. По умолчанию последние 7 дней.
+    """
+    if admin.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
+    date_to = date_to or datetime.now()
+    date_from = date_from or date_to - timedelta(days=7)
+    if not date_from < date_to <= date_from + ANALYTICS_MAX_PERIOD:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'from must be before to and the period at most {ANALYTICS_MAX_PERIOD.days} days')
+    return await build_report(session, date_from=date_from, date_to=date_to, top=top)
+
+
+@router.get('/get_stats')
+async def get_stats(admin: Annotated[AdminModel, Depends(get_current_user)]) -> dict[str, dict]:
+    """Состояние пулов, кешей, отзыва токенов и лимита входа в этом воркере"""
+    if admin.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
+    return {
+        'db_pool': engine.pool.stats(),
+        'db_replicas': replica_router.stats(),
+        'hashing': hashing_service.stats(),
+        'principal_cache': principal_cache.stats(),
+        'balance_cache': balance_cache.stats(),
+        'token_cache': token_cache.stats(),
+        'token_revocations': token_revocations.stats(),
+        'login_rate_limit': login_rate_limiter.stats(),
+        'webhook_queue': webhook_workers.stats(),
+    }
+
+
+@router.get('/webhook_inbox')
+async def get_webhook_inbox(admin: Annotated[AdminModel, Depends(get_current_user)],
+                            session: Annotated[AsyncSession, Depends(get_session)]) -> dict[str, int | float]:
+    """Очередь вебхуков в БД: события по статусам и отставание самого давнего необработанного"""
+    if admin.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
+    return await InboxCrud.get_inbox_stats(session)
+
+
+@router.patch('/requeue_dead_webhooks')
+async def requeue_dead_webhooks(admin: Annotated[AdminModel, Depends(get_current_user)],
+                                session: Annotated[AsyncSession, Depends(get_session)]) -> dict[str, str]:
+    """Вернет вебхуки из dead в очередь, например после исправления причины ошибки"""
+    if admin.role != 'admin':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='not admin')
+    return await InboxCrud.requeue_dead(session)
@@ -1,29 +1,32 @@
-from typing import Annotated
+import hashlib
+import time
+from typing import Annotated, AsyncIterator
 from datetime import timedelta, datetime, timezone
 
 import jwt
 from jwt import InvalidTokenError
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, Request, status, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.models import UserModel
-from app.core.config.config import setting_access_token, setting_refresh_token
+from app.api.models import PrincipalModel
+from app.core.config.config import setting_access_token, setting_refresh_token, setting_cache, session_maker
+from app.core.cache.cache import principal_cache, token_cache
 from app.core.database.crud import UserCrud
+from app.core.security.hashing import hashing_service
+from app.core.security.revocation import token_revocations
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+async def ahash(password) -> str:
+    """Вернет хеш пароля, посчитанный в пуле хеширования"""
+    return await hashing_service.hash(password)
 
-def get_password_hash(password) -> str:
-    """Вернет хеш пароля"""
-    return pwd_context.hash(password)
 
-
-def verify_password(plain_password, hashed_password) -> bool:
-    """Проверит пароль пользователя"""
-    return pwd_context.verify(plain_password, hashed_password)
+async def averify(plain_password, hashed_password) -> bool:
+    """Проверит пароль пользователя в пуле хеширования"""
+    return await hashing_service.verify(plain_password, hashed_password)
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
@@ -38,6 +41,24 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     return encoded_jwt
 
 
+def access_token_data(user: PrincipalModel) -> dict:
+    """
+    Данные для access токена. В stateless режиме в токен кладутся id, роль, состояние и имя,
+    а ver - время выдачи, по нему токен отзывается (см. TokenRevocations).
+    """
+    data = {'sub': user.email, 'type': 'access'}
+    if setting_access_token.ACCESS_TOKEN_STATELESS:
+        data.update({
+            'uid': user.id,
+            'role': user.role,
+            'state': user.state,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'ver': time.time(),
+        })
+    return data
+
+
 def create_refresh_token(data: dict, expires_delta: timedelta | None = None) -> str:
     """Создаст и вернет refresh jwt токен"""
     to_encode = data.copy()
@@ -50,25 +71,119 @@ def create_refresh_token(data: dict, expires_delta: timedelta | None = None) ->
     return encoded_jwt
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> UserModel:
-    """Проверит текущего пользователя"""
+def decode_token(token: str) -> dict:
+    """
+    jwt.decode с кешем: повторно присланный токен не проверяется заново до своего exp.
+    Токены, близкие к истечению, не кешируются, поэтому истекший токен всегда отклоняется jwt.decode.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = jwt.decode(token, setting_access_token.SECRET_KEY, algorithms=[setting_access_token.ALGORITHM])
+        ttl = payload.get('exp', 0) - time.time() - setting_cache.token_min_ttl_seconds
+        if ttl > 0:
+            token_cache.set(key, payload, ttl_seconds=ttl)
+    return payload
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """
+    Unit of work запроса: одна сессия и одна транзакция на весь запрос.
+    Соединение берется из пула при первом запросе к БД, коммит - после эндпоинта.
+    """
+    async with session_maker.begin() as session:
+        yield session
+
+
+async def _request_all_lines(request: Request) -> AsyncIterator[tuple[int, bytes]]:
+    """Прочитает тело запроса потоком и отдаст все строки, в том числе пустые, с их номерами"""
+    buffer = b''
+    line_number = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            line_number += 1
+            yield line_number, line
+    if buffer:
+        yield line_number + 1, buffer
+
+
+async def request_lines(request: Request) -> AsyncIterator[tuple[int, bytes]]:
+    """Прочитает тело запроса потоком и отдаст непустые строки с их номерами (NDJSON)"""
+    async for line_number, line in _request_all_lines(request):
+        if line.strip():
+            yield line_number, line
+
+
+async def request_csv_records(request: Request) -> AsyncIterator[tuple[int, bytes]]:
+    """
+    Прочитает CSV из тела запроса потоком и отдаст записи с номером их первой строки.
+    Строки склеиваются, пока в записи не закрыты кавычки, поэтому поле в кавычках с переводом строки
+    остается одной записью (экранированная кавычка "" не меняет четность).
+    """
+    record: list[bytes] = []
+    quotes = first_line = 0
+    async for line_number, line in _request_all_lines(request):
+        if not record:
+            if not line.strip():
+                continue
+            first_line = line_number
+        record.append(line)
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            yield first_line, b'\n'.join(record)
+            record, quotes = [], 0
+    if record:
+        yield first_line, b'\n'.join(record)
+
+
+async def get_principal(session: AsyncSession, email: str) -> PrincipalModel | None:
+    """Вернет пользователя из кеша, при промахе загрузит из БД"""
+    user = principal_cache.get(email)
+    if user is None:
+        epoch = principal_cache.epoch
+        user = await UserCrud.get_user_by_email(session, email=email)
+        if not isinstance(user, PrincipalModel):
+            return None
+        principal_cache.set(email, user, epoch=epoch)
+    return user
+
+
+def principal_from_token(payload: dict) -> PrincipalModel | None:
+    """Соберет пользователя из claims stateless токена; None, если токен выдан не в stateless режиме"""
+    if 'uid' not in payload:
+        return None
+    return PrincipalModel(id=payload['uid'], email=payload['sub'], first_name=payload['first_name'],
+                          last_name=payload['last_name'], password='', state=payload['state'], role=payload['role'])
+
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)],
+                           session: Annotated[AsyncSession, Depends(get_session)]) -> PrincipalModel:
+    """Проверит текущего пользователя; stateless токен проверяется без запросов в БД"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Could not validate credentials',
         headers={'WWW-Authenticate': 'Bearer'},
     )
     try:
-        payload = jwt.decode(token, setting_access_token.SECRET_KEY, algorithms=[setting_access_token.ALGORITHM])
+        payload = decode_token(token)
         type_token = payload.get('type')
         if type_token != 'access':
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f'Bad token, get {type_token}, expected access')
         email = payload.get('sub')
         if email is None:
             raise credentials_exception
-    except InvalidTokenError:
+        user = principal_from_token(payload) if setting_access_token.ACCESS_TOKEN_STATELESS else None
+    except (InvalidTokenError, KeyError, ValueError):
         raise credentials_exception
 
-    user = await UserCrud.get_user_by_email(email=email)
+    if user is not None:
+        if token_revocations.is_revoked(email, payload.get('ver', 0)):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='token revoked',
+                                headers={'WWW-Authenticate': 'Bearer'})
+    else:
+        user = await get_principal(session, email)
 
     if user is None:
         raise credentials_exception
@@ -76,7 +191,16 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> Use
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disabled')
     return user
 
-async def get_current_user_for_refresh(token: Annotated[str, Depends(oauth2_scheme)]) -> UserModel:
+async def get_current_user_detached(token: Annotated[str, Depends(oauth2_scheme)]) -> PrincipalModel:
+    """
+    Как get_current_user, но со своей короткой сессией, которая закрывается до вызова эндпоинта:
+    потоковые импорт и выгрузка не держат соединение и транзакцию на все время запроса
+    """
+    async with session_maker.begin() as session:
+        return await get_current_user(token, session)
+
+async def get_current_user_for_refresh(token: Annotated[str, Depends(oauth2_scheme)],
+                                       session: Annotated[AsyncSession, Depends(get_session)]) -> PrincipalModel:
     """Проверит текущего пользователя по refresh"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -84,7 +208,7 @@ async def get_current_user_for_refresh(token: Annotated[str, Depends(oauth2_sche
         headers={'WWW-Authenticate': 'Bearer'},
     )
     try:
-        payload = jwt.decode(token, setting_access_token.SECRET_KEY, algorithms=[setting_access_token.ALGORITHM])
+        payload = decode_token(token)
         type_token = payload.get('type')
         if type_token != 'refresh':
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f'Bad token, get {type_token}, expected refresh')
@@ -94,15 +218,10 @@ async def get_current_user_for_refresh(token: Annotated[str, Depends(oauth2_sche
     except InvalidTokenError:
         raise credentials_exception
 
-    user = await UserCrud.get_user_by_email(email=email)
+    user = await get_principal(session, email)
 
     if user is None:
         raise credentials_exception
     elif not user.state:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disabled')
     return user
-
-if __name__ == '__main__':
-    # 1-transaction_id , 2-score_id, 3-user_id, 4-amount, 5-secret_key
-    # в примере 1-transaction_id , 3-score_id, 3-user_id, 55-amount, 09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7-secret_key
-    print(get_password_hash('3115509d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7'))
\ No newline at end of file
@@ -1 +1 @@
-from app.api.models.models import UserModel, AdminModel, PaymentModel, PaymentDateModel
+from app.api.models.models import UserModel, PrincipalModel, UserPublicModel, UserScoreModel, UserImportModel, UserImportErrorModel, UserImportResultModel, UserPageModel, ScoreModel, AdminModel, PaymentModel, PaymentDateModel, PaymentPageModel, PaymentStatusModel, PaymentsTotalModel, StatementModel, TopAccountModel, BalanceAnalyticsModel, PaymentVolumeModel, WebhookOutcomesModel, AnalyticsModel
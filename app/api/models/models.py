@@ -1,7 +1,14 @@
 from datetime import datetime
 from decimal import Decimal
+from typing import Annotated, Literal
 
-from pydantic import BaseModel, ConfigDict, EmailStr
+from pydantic import AfterValidator, BaseModel, ConfigDict, EmailStr, Field, model_validator
+
+from app.core.database.money import check_precision
+
+
+# сумма денег на входе API, не точнее минимальной единицы (MONEY_PRECISION знаков) в любом режиме хранения
+Amount = Annotated[Decimal, AfterValidator(check_precision)]
 
 
 class Base(BaseModel):
@@ -20,21 +27,167 @@ class UserModel(Base):
     model_config = ConfigDict(from_attributes=True)
 
 
+class PrincipalModel(UserModel):
+    """Текущий пользователь запроса вместе с id"""
+    id: int
+
+
+class UserPublicModel(Base):
+    """Пользователь без пароля, для списков в админке"""
+    id: int
+    email: EmailStr
+    first_name: str
+    last_name: str
+    state: bool
+    role: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class UserScoreModel(UserPublicModel):
+    """Пользователь и один его счет, строка выгрузки пользователей со счетами"""
+    score_id: int | None = None
+    score: Decimal | None = None
+
+
+class UserImportModel(Base):
+    """Строка импорта пользователей: открытый password или готовый bcrypt хеш в password_hash"""
+    email: EmailStr
+    first_name: str
+    last_name: str
+    password: str | None = None
+    password_hash: str | None = Field(default=None, pattern=r'^\$2[aby]\$\d\d\$[./A-Za-z0-9]{53}$')
+    state: bool = True
+    role: str = 'basic'
+
+    @model_validator(mode='after')
+    def check_password(self) -> 'UserImportModel':
+        if (self.password is None) == (self.password_hash is None):
+            raise ValueError('exactly one of password or password_hash is required')
+        return self
+
+
+class UserImportErrorModel(Base):
+    """Строка импорта, которая не была добавлена"""
+    line: int
+    email: str | None = None
+    error: str
+
+
+class UserImportResultModel(Base):
+    """Итог импорта пользователей"""
+    created: int
+    errors: list[UserImportErrorModel]
+
+
+class UserPageModel(Base):
+    """Страница пользователей, next_cursor передается в after_id для следующей страницы"""
+    items: list[UserPublicModel]
+    next_cursor: int | None = None
+
+
+class ScoreModel(Base):
+    """Счет пользователя с балансом"""
+    score_id: int
+    score: Decimal
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class PaymentModel(Base):
     """Валидация платежа"""
     transaction_id: int
     score_id: int
     user_id: int
-    amount: Decimal
+    amount: Amount
     signature: str
 
     model_config = ConfigDict(from_attributes=True)
 
 class PaymentDateModel(PaymentModel):
-    """Для crud get_all_payments, чтобы вернуть и время платежа"""
+    """Для crud get_payments_page, чтобы вернуть и время платежа"""
+    payment_id: int
     datetime_payment: datetime
 
 
+class PaymentPageModel(Base):
+    """Страница платежей, next_* передаются в before_* для следующей страницы"""
+    items: list[PaymentDateModel]
+    next_datetime: datetime | None = None
+    next_id: int | None = None
+
+
+class PaymentStatusModel(Base):
+    """Результат обработки платежа из пачки вебхуков"""
+    transaction_id: int
+    status: Literal['credited', 'duplicate', 'bad signature', 'unknown score']
+
+
+class StatementModel(Base):
+    """Итоги зачислений по счету за период"""
+    score_id: int
+    total_amount: Decimal
+    payments_count: int
+    first_payment: datetime
+    last_payment: datetime
+
+
+class PaymentsTotalModel(Base):
+    """Сумма и число платежей за период для отчета админа"""
+    total_amount: Decimal
+    payments_count: int
+
+
+class TopAccountModel(Base):
+    """Счет из топа по балансу"""
+    score_id: int
+    user_id: int
+    score: Decimal
+
+
+class BalanceAnalyticsModel(Base):
+    """Распределение балансов; перцентили приближенные, с относительной ошибкой до 0.5%"""
+    scores_count: int
+    total_liabilities: Decimal
+    min_balance: Decimal | None = None
+    max_balance: Decimal | None = None
+    percentiles: dict[str, Decimal]
+    top: list[TopAccountModel]
+
+
+class PaymentVolumeModel(Base):
+    """Платежи за час или день, начинающийся в period_start"""
+    period_start: datetime
+    payments_count: int
+    total_amount: Decimal
+
+
+class WebhookOutcomesModel(Base):
+    """
+    Исходы всех вебхуков за период (синхронные, пачки и очередь).
+    failed - неизвестный счет, неверная подпись и события очереди, ушедшие в dead
+    """
+    received: int
+    credited: int
+    duplicate: int
+    failed: int
+    bad_signature: int
+    pending: int
+    duplicate_rate: float
+    failed_rate: float
+
+
+class AnalyticsModel(Base):
+    """Аналитика для админа за период [date_from, date_to)"""
+    date_from: datetime
+    date_to: datetime
+    balances: BalanceAnalyticsModel
+    payments_count: int
+    payments_total: Decimal
+    hourly: list[PaymentVolumeModel]
+    daily: list[PaymentVolumeModel]
+    webhooks: WebhookOutcomesModel
+
 
 class AdminModel(UserModel):
     """Валидация админа"""
@@ -2,9 +2,10 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import EmailStr
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.models import UserModel
-from app.api.depends.depends import get_current_user, get_password_hash
+from app.api.depends.depends import get_current_user, get_session, ahash
 from app.core.config.config import HTTP_BEARER
 from app.core.database.crud import UserCrud, ScoreCrud
 
@@ -12,11 +13,12 @@ router = APIRouter(tags=['User'], prefix='/users', dependencies=[Depends(HTTP_BE
 
 
 @router.get('/get_user_id')
-async def get_user_id(user: Annotated[UserModel, Depends(get_current_user)]) -> int | None:
+async def get_user_id(user: Annotated[UserModel, Depends(get_current_user)],
+                      session: Annotated[AsyncSession, Depends(get_session)]) -> int | None:
     """Вернет пользователя по id"""
     if not user.state:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
-    user = await UserCrud.get_user_id(email=user.email)
+    user = await UserCrud.get_user_id(session, email=user.email)
     return user if user else {'msg': 'user id not found'}
 
 
@@ -38,28 +40,31 @@ async def get_user_fullname(user: Annotated[UserModel, Depends(get_current_user)
 
 @router.patch('/update_email')
 async def update_email(new_email: EmailStr,
-                       user: Annotated[UserModel, Depends(get_current_user)]
+                       user: Annotated[UserModel, Depends(get_current_user)],
+                       session: Annotated[AsyncSession, Depends(get_session)]
                        ) -> dict[str, str] | None:
     """Обновит email пользователя"""
     if not user.state:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
-    return await UserCrud.patch_email_user(new_email=new_email, old_email=user.email)
+    return await UserCrud.patch_email_user(session, new_email=new_email, old_email=user.email)
 
 
 @router.patch('/update_password')
 async def update_password(new_password: str,
-                          user: Annotated[UserModel, Depends(get_current_user)]
+                          user: Annotated[UserModel, Depends(get_current_user)],
+                          session: Annotated[AsyncSession, Depends(get_session)]
                           ) -> dict[str, str] | None:
     """Обновит password пользователя"""
     if not user.state:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
-    hash_password = get_password_hash(password=new_password)
-    return await UserCrud.patch_password(new_password=hash_password, email=user.email)
+    hash_password = await ahash(new_password)
+    return await UserCrud.patch_password(session, new_password=hash_password, email=user.email)
 
 
 @router.delete('/delete_score')
-async def delete_score(user: Annotated[UserModel, Depends(get_current_user)]) -> dict[str, str] | None:
+async def delete_score(user: Annotated[UserModel, Depends(get_current_user)],
+                       session: Annotated[AsyncSession, Depends(get_session)]) -> dict[str, str] | None:
     """Удалит счет пользователя"""
     if not user.state:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
-    return await ScoreCrud.delete_score_user(user.email)
+    return await ScoreCrud.delete_score_user(session, user.email)
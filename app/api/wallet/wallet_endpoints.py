@@ -1,54 +1,158 @@
+from collections import Counter
+from datetime import date, datetime
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.depends.depends import get_current_user, get_password_hash, verify_password
-from app.api.models.models import PaymentModel, UserModel
-from app.core.database.crud import ScoreCrud, PaymentCrud, UserCrud
-from app.core.config.config import setting_check_sig, HTTP_BEARER
+from app.api.depends.depends import get_current_user, get_session, request_lines
+from app.api.models.models import PaymentModel, PaymentPageModel, PaymentStatusModel, PrincipalModel, ScoreModel, StatementModel, UserModel
+from app.core.database.crud import InboxCrud, ScoreCrud, PaymentCrud
+from app.core.config.config import HTTP_BEARER
+from app.core.queue.queue import notify_on_commit, webhook_rejections
+from app.core.security.signature import signature_verifier
 
 router = APIRouter(prefix='/wallets', tags=['Wallet'], dependencies=[Depends(HTTP_BEARER)])
 
+# ответы transfer_money, при которых вебхук ничего не зачислил
+TRANSFER_REJECTIONS = {'transaction already processed': 'duplicate', 'score not found': 'unknown score'}
+
 
 @router.get('/get_user_scores')
-async def get_user_scores(user: Annotated[UserModel, Depends(get_current_user)]) -> dict | None:
-    """Получить счета пользователя"""
+async def get_user_scores(user: Annotated[PrincipalModel, Depends(get_current_user)],
+                          session: Annotated[AsyncSession, Depends(get_session)]) -> list[ScoreModel]:
+    """Получить счета пользователя с балансами, балансы отдаются из кеша до следующего зачисления"""
     if not user.state:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
-    return await ScoreCrud.get_user_scores(email=user.email)
+    return await ScoreCrud.get_user_scores_cached(session, user_id=user.id)
 
 @router.get('/get_user_payments')
-async def get_user_payments(user: Annotated[UserModel, Depends(get_current_user)]) -> list[PaymentModel] | None:
-    """Получить платежи пользователя"""
+async def get_user_payments(user: Annotated[PrincipalModel, Depends(get_current_user)],
+                            session: Annotated[AsyncSession, Depends(get_session)],
+                            date_from: Annotated[datetime | None, Query(alias='from')] = None,
+                            date_to: Annotated[datetime | None, Query(alias='to')] = None,
+                            score_id: int | None = None,
+                            before_datetime: datetime | None = None,
+                            before_id: int | None = None,
+                            limit: Annotated[int, Query(ge=1, le=1000)] = 100
+                            ) -> PaymentPageModel:
+    """Получить платежи пользователя от новых к старым, для следующей страницы передать next_* в before_*"""
+    if not user.state:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
+    return await PaymentCrud.get_payments_page(session, user_id=user.id, date_from=date_from, date_to=date_to,
+                                               score_id=score_id, before_datetime=before_datetime,
+                                               before_id=before_id, limit=limit)
+
+@router.get('/get_statement')
+async def get_statement(user: Annotated[PrincipalModel, Depends(get_current_user)],
+                        session: Annotated[AsyncSession, Depends(get_session)],
+                        date_from: Annotated[date, Query(alias='from')],
+                        date_to: Annotated[date, Query(alias='to')],
+                        score_id: int | None = None
+                        ) -> list[StatementModel]:
+    """Итоги зачислений по счетам пользователя за дни [from, to): сумма, число платежей, первый и последний платеж"""
     if not user.state:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
-    user_id = await UserCrud.get_user_id(email=user.email)
-    return await PaymentCrud.get_all_payments(user_id=user_id)
+    if date_from >= date_to:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='from must be before to')
+    return await PaymentCrud.get_statement(session, user_id=user.id, date_from=date_from, date_to=date_to,
+                                           score_id=score_id)
 
 @router.get('/create_new_score')
-async def create_new_score(user: Annotated[UserModel, Depends(get_current_user)]) -> dict[str, str]:
+async def create_new_score(user: Annotated[UserModel, Depends(get_current_user)],
+                           session: Annotated[AsyncSession, Depends(get_session)]) -> dict[str, str]:
     """Создаст новый счет пользователя"""
     if not user.state:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
-    return await ScoreCrud.create_new_score(email=user.email)
+    return await ScoreCrud.create_new_score(session, email=user.email)
 
 
 @router.post('/top_up_the_users_balance')
 async def top_up_the_users_balance(payment: Annotated[PaymentModel, Depends()],
-                                   user: Annotated[UserModel, Depends(get_current_user)]
+                                   user: Annotated[UserModel, Depends(get_current_user)],
+                                   session: Annotated[AsyncSession, Depends(get_session)]
                                    ) -> dict[str, str] | None:
     """Зачислит деньги на счет. Обрабатывает вебхук от сторонней платежной системы."""
     if not user.state:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
 
-    concatenated_string = (f"{payment.score_id}{payment.amount}{payment.transaction_id}"
-                           f"{payment.user_id}{setting_check_sig.SECRET_KEY}")
-    expected_signature = get_password_hash(concatenated_string.encode())
+    if not signature_verifier.verify(payment):
+        webhook_rejections.add('sync', {'bad signature': 1})
+        raise HTTPException(status_code=400, detail="Invalid signature")
+
+    result = await PaymentCrud.transfer_money(session, amount=payment.amount,
+                                              score_id=payment.score_id,
+                                              user_id=payment.user_id,
+                                              payment=payment)
+    if result['msg'] in TRANSFER_REJECTIONS:
+        webhook_rejections.add('sync', {TRANSFER_REJECTIONS[result['msg']]: 1})
+    return result
 
-    if verify_password(payment.signature, expected_signature):
+
+@router.post('/top_up_the_users_balance_async', status_code=status.HTTP_202_ACCEPTED)
+async def top_up_the_users_balance_async(payment: Annotated[PaymentModel, Depends()],
+                                         user: Annotated[UserModel, Depends(get_current_user)],
+                                         session: Annotated[AsyncSession, Depends(get_session)]
+                                         ) -> dict[str, str]:
+    """
+    Примет вебхук в очередь и сразу ответит 202, зачислят воркеры очереди.
+    Повторный transaction_id тоже получает 202, зачисление будет одно.
+    """
+    if not user.state:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
+
+    if not signature_verifier.verify(payment):
+        webhook_rejections.add('async', {'bad signature': 1})
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    return await PaymentCrud.transfer_money(amount=payment.amount,
-                                            score_id=payment.score_id,
-                                            user_id=payment.user_id,
-                                            payment=payment)
+    notify_on_commit(session)
+    return await InboxCrud.enqueue(session, payment)
+
+
+async def credit_payments_batch(session: AsyncSession, payments: list[PaymentModel]) -> list[PaymentStatusModel]:
+    """Проверит подписи и зачислит пачку платежей одной транзакцией"""
+    signed = [signature_verifier.verify(payment) for payment in payments]
+    credited = iter(await PaymentCrud.transfer_money_batch(
+        session,
+        [payment for payment, is_signed in zip(payments, signed) if is_signed]
+    ))
+    statuses = [PaymentStatusModel(transaction_id=payment.transaction_id,
+                                   status=next(credited) if is_signed else 'bad signature')
+                for payment, is_signed in zip(payments, signed)]
+    webhook_rejections.add('batch', Counter(
+        payment_status.status for payment_status in statuses if payment_status.status != 'credited'
+    ))
+    return statuses
+
+
+@router.post('/top_up_the_users_balance_batch')
+async def top_up_the_users_balance_batch(payments: list[PaymentModel],
+                                         user: Annotated[UserModel, Depends(get_current_user)],
+                                         session: Annotated[AsyncSession, Depends(get_session)]
+                                         ) -> list[PaymentStatusModel]:
+    """Зачислит пачку вебхуков (json массив) одной транзакцией, вернет статус по каждому платежу"""
+    if not user.state:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
+    return await credit_payments_batch(session, payments)
+
+
+@router.post('/top_up_the_users_balance_ndjson')
+async def top_up_the_users_balance_ndjson(request: Request,
+                                          user: Annotated[UserModel, Depends(get_current_user)],
+                                          session: Annotated[AsyncSession, Depends(get_session)]
+                                          ) -> list[PaymentStatusModel]:
+    """Зачислит пачку вебхуков из NDJSON потока (один платеж на строку)"""
+    if not user.state:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='user disable')
+
+    payments = [_parse_ndjson_line(line, line_number) async for line_number, line in request_lines(request)]
+    return await credit_payments_batch(session, payments)
+
+
+def _parse_ndjson_line(line: bytes, line_number: int) -> PaymentModel:
+    try:
+        return PaymentModel.model_validate_json(line)
+    except ValidationError as error:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f'line {line_number}: {error.errors(include_url=False)}')
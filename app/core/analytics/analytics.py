@@ -0,0 +1,147 @@
+"""
+Аналитика для админа по всем счетам и платежам.
+
+Счета и платежи читаются потоком COPY пачками по chunk_size строк сразу в массивы numpy
+(app.core.database.copy), каждая пачка вливается в накопители фиксированного размера, поэтому память не зависит от размера таблиц.
+Вычисления по пачке выполняются в пуле потоков, чтобы не блокировать event loop.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.models import AnalyticsModel, BalanceAnalyticsModel, PaymentVolumeModel, TopAccountModel
+from app.core.database.crud import InboxCrud, PaymentCrud, ScoreCrud
+from app.core.database.money import from_minor, sum_minor
+
+CHUNK_ROWS = 50_000
+PERCENTILES = (50, 90, 99, 99.9)
+EPOCH = datetime(1970, 1, 1)
+
+# границы корзин гистограммы балансов: геометрическая сетка с шагом 1%, поэтому середина корзины
+# отличается от любого баланса в ней не больше чем на 0.5%; в корзину 0 попадают нулевые балансы
+BALANCE_EDGES = np.geomspace(1, float(np.iinfo(np.int64).max), num=4400)
+
+
+class BalanceAccumulator:
+    """Сумма, минимум, максимум, гистограмма для перцентилей и топ счетов по балансу"""
+
+    def __init__(self, top: int) -> None:
+        self.top = top
+        self.count = 0
+        self.total = 0
+        self.min: int | None = None
+        self.max: int | None = None
+        self.histogram = np.zeros(len(BALANCE_EDGES) + 1, dtype=np.int64)
+        self.top_rows = np.empty((0, 3), dtype=np.int64)
+
+    def add(self, chunk: np.ndarray) -> None:
+        """Вольет пачку строк (score_id, user_id, баланс в минимальных единицах)"""
+        balances = chunk[:, 2]
+        self.count += len(balances)
+        self.total += sum_minor(balances)
+        chunk_min, chunk_max = int(balances.min()), int(balances.max())
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+        self.histogram += np.bincount(np.searchsorted(BALANCE_EDGES, balances, side='right'),
+                                      minlength=len(self.histogram))
+        if not self.top:
+            return
+        candidates = np.concatenate([self.top_rows, chunk])
+        if len(candidates) > self.top:
+            candidates = candidates[np.argpartition(candidates[:, 2], -self.top)[-self.top:]]
+        self.top_rows = candidates
+
+    def percentile(self, q: float) -> int:
+        """Приближенный перцентиль q по гистограмме, в минимальных единицах"""
+        rank = q / 100 * (self.count - 1)
+        bucket = int(np.searchsorted(np.cumsum(self.histogram), rank, side='right'))
+        if bucket == 0:
+            return min(self.min, 0)
+        upper = BALANCE_EDGES[min(bucket, len(BALANCE_EDGES) - 1)]
+        value = round(float(np.sqrt(BALANCE_EDGES[bucket - 1] * upper)))
+        return max(self.min, min(self.max, value))
+
+    def result(self) -> BalanceAnalyticsModel:
+        top_rows = self.top_rows[np.argsort(-self.top_rows[:, 2], kind='stable')] if self.top else self.top_rows[:0]
+        return BalanceAnalyticsModel(
+            scores_count=self.count,
+            total_liabilities=from_minor(self.total),
+            min_balance=None if self.min is None else from_minor(self.min),
+            max_balance=None if self.max is None else from_minor(self.max),
+            percentiles={f'p{q:g}': from_minor(self.percentile(q)) for q in PERCENTILES} if self.count else {},
+            top=[TopAccountModel(score_id=int(score_id), user_id=int(user_id), score=from_minor(int(balance)))
+                 for score_id, user_id, balance in top_rows],
+        )
+
+
+class PaymentVolumeAccumulator:
+    """Число и сумма платежей по календарным часам периода; дни складываются из часов с полуночи"""
+
+    def __init__(self, date_from: datetime, date_to: datetime) -> None:
+        self.date_from = datetime.combine(date_from.date(), datetime.min.time())
+        self.start = int((self.date_from - EPOCH).total_seconds())
+        hours = -(-int((date_to - self.date_from).total_seconds()) // 3600)
+        self.counts = np.zeros(hours, dtype=np.int64)
+        self.totals = np.zeros(hours, dtype=np.int64)
+
+    def add(self, chunk: np.ndarray) -> None:
+        """Вольет пачку строк (unix время платежа, сумма в минимальных единицах)"""
+        hours = (chunk[:, 0] - self.start) // 3600
+        self.counts += np.bincount(hours, minlength=len(self.counts))
+        np.add.at(self.totals, hours, chunk[:, 1])
+
+    def _periods(self, counts: np.ndarray, totals: np.ndarray, step: timedelta) -> list[PaymentVolumeModel]:
+        return [PaymentVolumeModel(period_start=self.date_from + step * index, payments_count=int(counts[index]),
+                                   total_amount=from_minor(int(totals[index])))
+                for index in np.flatnonzero(counts)]
+
+    def hourly(self) -> list[PaymentVolumeModel]:
+        return self._periods(self.counts, self.totals, timedelta(hours=1))
+
+    def daily(self) -> list[PaymentVolumeModel]:
+        day_starts = np.arange(0, len(self.counts), 24)
+        return self._periods(np.add.reduceat(self.counts, day_starts), np.add.reduceat(self.totals, day_starts),
+                             timedelta(days=1))
+
+
+async def _drain(chunks, accumulator) -> None:
+    """Читает следующую пачку из курсора, пока предыдущая обрабатывается в пуле потоков"""
+    pending = None
+    async for chunk in chunks:
+        if pending is not None:
+            await pending
+        pending = asyncio.create_task(asyncio.to_thread(accumulator.add, chunk))
+    if pending is not None:
+        await pending
+
+
+async def build_report(session: AsyncSession,
+                       date_from: datetime,
+                       date_to: datetime,
+                       top: int = 10,
+                       chunk_size: int = CHUNK_ROWS
+                       ) -> AnalyticsModel:
+    """
+    Соберет аналитику: балансы по всем счетам на текущий момент, объем платежей по часам и дням
+    и исходы вебхуков за [date_from, date_to). Счета и платежи читаются параллельно двумя курсорами.
+    """
+    balances = BalanceAccumulator(top)
+    volume = PaymentVolumeAccumulator(date_from, date_to)
+    await asyncio.gather(
+        _drain(ScoreCrud.stream_balances(chunk_size), balances),
+        _drain(PaymentCrud.stream_payment_amounts(date_from, date_to, chunk_size), volume),
+    )
+    webhooks = await InboxCrud.get_webhook_outcomes(session, date_from=date_from, date_to=date_to,
+                                                    credited=int(volume.counts.sum()))
+    return AnalyticsModel(
+        date_from=date_from,
+        date_to=date_to,
+        balances=balances.result(),
+        payments_count=int(volume.counts.sum()),
+        payments_total=from_minor(sum_minor(volume.totals)),
+        hourly=volume.hourly(),
+        daily=volume.daily(),
+        webhooks=webhooks,
+    )
@@ -0,0 +1,154 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config.config import setting_cache
+
+
+class CacheBackend(ABC):
+    """
+    Интерфейс кеша. В памяти процесса - TTLCache; общий для всех воркеров кеш
+    реализует этот же интерфейс поверх внешнего хранилища.
+    """
+
+    @property
+    @abstractmethod
+    def epoch(self) -> int:
+        """Номер инвалидации: запомнить перед чтением из БД и передать в set"""
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Any | None:
+        """Вернет значение или None"""
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, epoch: int | None = None, ttl_seconds: float | None = None) -> None:
+        """Сохранит значение, если с момента epoch не было инвалидации этого ключа"""
+
+    @abstractmethod
+    def invalidate(self, *keys: Hashable) -> None:
+        """Удалит записи по ключам"""
+
+    @abstractmethod
+    def stats(self) -> dict[str, int | float]:
+        """Счетчики попаданий и промахов"""
+
+
+class TTLCache(CacheBackend):
+    """
+    LRU кеш в памяти процесса с временем жизни записей.
+    Эпоха растет при каждой инвалидации, а инвалидированный ключ запоминает ее номер:
+    значение, прочитанное из БД до инвалидации этого ключа, не попадет в кеш (см. epoch и set),
+    заполнение других ключей при этом не отбрасывается.
+    Номера хранятся для последних max_size инвалидированных ключей; заполнение, начатое раньше
+    самой старой из них, отбрасывается для любого ключа.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._epoch = 0
+        self._invalidated: OrderedDict[Hashable, int] = OrderedDict()
+        self._forgotten_epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def epoch(self) -> int:
+        """Запомнить перед чтением из БД и передать в set"""
+        return self._epoch
+
+    def get(self, key: Hashable) -> Any | None:
+        """Вернет значение или None, если записи нет или она устарела"""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, epoch: int | None = None, ttl_seconds: float | None = None) -> None:
+        """
+        Сохранит значение; если с момента epoch была инвалидация, ничего не сделает.
+        ttl_seconds - время жизни этой записи, если оно короче времени жизни кеша
+        """
+        if epoch is not None and (epoch < self._forgotten_epoch or self._invalidated.get(key, 0) > epoch):
+            return
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """Удалит записи по ключам"""
+        self._epoch += 1
+        for key in keys:
+            self._data.pop(key, None)
+            self._invalidated[key] = self._epoch
+            self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.max_size:
+            _, self._forgotten_epoch = self._invalidated.popitem(last=False)
+
+    def clear(self) -> None:
+        self._epoch += 1
+        self._forgotten_epoch = self._epoch
+        self._invalidated.clear()
+        self._data.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+def invalidate_on_commit(session: AsyncSession, cache: Any, *keys: Hashable) -> None:
+    """
+    Инвалидирует ключи кеша сразу и еще раз после коммита транзакции сессии.
+    cache - CacheBackend или любой объект с методом invalidate(*keys), например таблица отзыва токенов
+    """
+    cache.invalidate(*keys)
+    session.sync_session.info.setdefault('invalidate_on_commit', []).append((cache, keys))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session: Session) -> None:
+    for cache, keys in session.info.pop('invalidate_on_commit', []):
+        cache.invalidate(*keys)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session: Session) -> None:
+    session.info.pop('invalidate_on_commit', None)
+
+
+principal_cache = TTLCache(max_size=setting_cache.principal_max_size,
+                           ttl_seconds=setting_cache.principal_ttl_seconds)
+
+# балансы счетов по id пользователя, сбрасываются после коммита зачисления или изменения счетов
+balance_cache: CacheBackend = TTLCache(max_size=setting_cache.balance_max_size,
+                                       ttl_seconds=setting_cache.balance_ttl_seconds)
+
+# разобранные jwt по sha256 токена, запись живет до exp токена (см. decode_token)
+token_cache = TTLCache(max_size=setting_cache.token_max_size,
+                       ttl_seconds=setting_cache.token_max_ttl_seconds)
@@ -1,8 +1,13 @@
 import os
+from functools import partial
 
 from fastapi.security import HTTPBearer
-from pydantic_settings import BaseSettings
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
+
+from app.core.database.pool import MetricsQueuePool
+from app.core.database.routing import ReplicaRouter, RoutingSession
+from app.core.metrics.metrics import instrument_engine
 
 HTTP_BEARER = HTTPBearer(auto_error=False)
 
@@ -11,9 +16,167 @@ class DataBaseSettings(BaseSettings):
     Установка полей для базы данных
     url - драйвер для бд
     echo - вывод в консоль запросов в бд
+    pool_size - постоянные соединения в пуле
+    max_overflow - сколько соединений можно открыть сверх pool_size
+    pool_timeout - сколько секунд ждать свободное соединение
+    pool_recycle - через сколько секунд переоткрывать соединение (-1 - никогда)
+    pool_pre_ping - проверять соединение перед выдачей из пула
+    prepared_statement_cache_size - размер кеша подготовленных запросов asyncpg на соединение
+    replica_urls - реплики для чтения (json список), пусто - все запросы идут в url
+    replica_check_interval - как часто проверять реплики, секунд
+    replica_check_timeout - сколько ждать ответа реплики при проверке, секунд
     """
     url: str = 'postgresql+asyncpg://postgres:123@pg:5432/postgres'
     echo: bool = False
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = -1
+    pool_pre_ping: bool = False
+    prepared_statement_cache_size: int = 100
+    replica_urls: list[str] = []
+    replica_check_interval: float = 5.0
+    replica_check_timeout: float = 2.0
+
+
+class ServerSettings(BaseSettings):
+    """
+    Настройка запуска uvicorn
+    mode - dev (один процесс с reload) или prod (несколько воркеров)
+    host, port - адрес сервера
+    workers - количество воркеров в prod, 0 - по числу доступных ядер
+    loop - event loop: auto, uvloop или asyncio
+    http - http парсер: auto, httptools или h11
+    keep_alive - сколько секунд держать простаивающее keep-alive соединение
+    backlog - очередь входящих соединений сокета
+    graceful_timeout - сколько секунд ждать завершения запросов при остановке
+    limit_max_requests - перезапуск воркера после стольких запросов (0 - без перезапуска)
+    access_log - писать access log uvicorn в prod; время запросов по маршрутам есть и в /metrics
+    """
+    mode: str = 'dev'
+    host: str = '0.0.0.0'
+    port: int = 8000
+    workers: int = 0
+    loop: str = 'auto'
+    http: str = 'auto'
+    keep_alive: int = 5
+    backlog: int = 2048
+    graceful_timeout: int = 30
+    limit_max_requests: int = 0
+    access_log: bool = True
+
+    model_config = SettingsConfigDict(env_prefix='SERVER_')
+
+    def worker_count(self) -> int:
+        """Количество воркеров: явно заданное или по числу ядер, доступных процессу"""
+        if self.workers > 0:
+            return self.workers
+        if hasattr(os, 'sched_getaffinity'):
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count() or 1
+
+
+class HashingSettings(BaseSettings):
+    """
+    Настройка пула для хеширования паролей
+    executor - тип пула: thread или process
+    max_workers - количество воркеров в пуле
+    max_concurrency - сколько хешей считается одновременно, остальные ждут в очереди
+    """
+    executor: str = 'thread'
+    max_workers: int = os.cpu_count() or 1
+    max_concurrency: int = (os.cpu_count() or 1) * 2
+
+    model_config = SettingsConfigDict(env_prefix='HASH_')
+
+
+class CacheSettings(BaseSettings):
+    """
+    Настройка кешей в памяти процесса
+    principal_max_size - сколько пользователей держать в кеше get_current_user
+    principal_ttl_seconds - время жизни записи о пользователе
+    balance_max_size - для скольких пользователей держать балансы счетов
+    balance_ttl_seconds - время жизни балансов; зачисления в других воркерах видны не позже, чем через него
+    token_max_size - сколько разобранных jwt держать в кеше
+    token_max_ttl_seconds - максимальное время жизни разобранного jwt в кеше
+    token_min_ttl_seconds - токены, которым до exp осталось меньше, не кешируются и проверяются каждый раз
+    """
+    principal_max_size: int = 10_000
+    principal_ttl_seconds: float = 30.0
+    balance_max_size: int = 100_000
+    balance_ttl_seconds: float = 5.0
+    token_max_size: int = 10_000
+    token_max_ttl_seconds: float = 3600.0
+    token_min_ttl_seconds: float = 30.0
+
+    model_config = SettingsConfigDict(env_prefix='CACHE_')
+
+
+class RateLimitSettings(BaseSettings):
+    """
+    Лимит попыток входа в /auth/token, считается в памяти воркера
+    enabled - включен ли лимит
+    login_per_email - попыток на один email за окно
+    login_per_ip - попыток с одного ip за окно
+    window_seconds - длина скользящего окна
+    max_keys - сколько счетчиков держать в памяти
+    """
+    enabled: bool = True
+    login_per_email: int = 10
+    login_per_ip: int = 100
+    window_seconds: float = 60.0
+    max_keys: int = 100_000
+
+    model_config = SettingsConfigDict(env_prefix='RATE_LIMIT_')
+
+
+class WebhookQueueSettings(BaseSettings):
+    """
+    Очередь вебхуков зачисления (таблица webhook_inbox) и воркеры, которые ее разбирают
+    workers - сколько воркеров разбирают очередь в каждом процессе, 0 - не разбирать в этом процессе
+    batch_size - сколько событий воркер забирает и зачисляет одной транзакцией
+    poll_interval - пауза воркера, когда очередь пуста
+    max_attempts - после стольких неудачных попыток событие уходит в dead
+    retry_base_seconds - задержка перед первым повтором, дальше удваивается
+    retry_max_seconds - максимальная задержка перед повтором
+    rejections_flush_seconds - как часто сбрасывать накопленные в памяти отказы вебхуков в webhook_rejections
+    """
+    workers: int = 2
+    batch_size: int = 100
+    poll_interval: float = 0.5
+    max_attempts: int = 5
+    retry_base_seconds: float = 1.0
+    retry_max_seconds: float = 300.0
+    rejections_flush_seconds: float = 10.0
+
+    model_config = SettingsConfigDict(env_prefix='WEBHOOK_QUEUE_')
+
+
+class MoneySettings(BaseSettings):
+    """
+    Хранение денежных сумм (балансы, платежи, итоги)
+    minor_units - хранить суммы целым BIGINT в минимальных единицах (копейках) вместо NUMERIC;
+    включается вместе с миграцией money_minor_units (MONEY_MINOR_UNITS=true alembic upgrade head)
+    precision - знаков после запятой у валюты, 2 - копейки
+    """
+    minor_units: bool = False
+    precision: int = 2
+
+    model_config = SettingsConfigDict(env_prefix='MONEY_')
+
+
+class PartitionSettings(BaseSettings):
+    """
+    Месячные партиции таблицы payments
+    months_ahead - на сколько месяцев вперед держать созданные партиции
+    keep_months - сколько последних месяцев (считая текущий) держать в БД, старые партиции выгружаются в архив; 0 - не архивировать
+    archive_dir - каталог для архивов партиций (csv.gz)
+    """
+    months_ahead: int = 3
+    keep_months: int = 0
+    archive_dir: str = 'archive'
+
+    model_config = SettingsConfigDict(env_prefix='PARTITION_')
 
 
 class SettingToken(BaseSettings):
@@ -27,8 +190,14 @@ class SettingToken(BaseSettings):
 
 
 class AccessToken(SettingToken):
-    """access token - время действия"""
+    """
+    access token - время действия
+    ACCESS_TOKEN_STATELESS - класть в токен id, роль, состояние и имя пользователя и авторизовать
+    запросы по токену без БД; отзыв токенов хранится в памяти воркера, поэтому в prod
+    с несколькими воркерами другие воркеры принимают отозванный токен до его истечения
+    """
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    ACCESS_TOKEN_STATELESS: bool = False
 
 
 class RefreshToken(SettingToken):
@@ -36,16 +205,61 @@ class RefreshToken(SettingToken):
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
 
 
+class WebhookSignature(SettingToken):
+    """
+    Подпись вебхуков платежной системы
+    PREVIOUS_SECRET_KEYS - старые ключи, которые еще принимаются во время ротации (json список)
+    ACCEPT_SHA256_SIGNATURES - принимать наряду с HMAC подписи по схеме из спецификации
+    sha256({account_id}{amount}{transaction_id}{user_id}{secret_key}); выключить, когда платежная система перейдет на HMAC
+    """
+    PREVIOUS_SECRET_KEYS: list[str] = []
+    ACCEPT_SHA256_SIGNATURES: bool = True
+
+    def active_secret_keys(self) -> list[str]:
+        """Вернет все действующие ключи, первым идет текущий"""
+        return [self.SECRET_KEY, *self.PREVIOUS_SECRET_KEYS]
+
+
 setting_database = DataBaseSettings()
+setting_server = ServerSettings()
 setting_access_token = AccessToken()
 setting_refresh_token = RefreshToken()
-setting_check_sig = SettingToken()
+setting_check_sig = WebhookSignature()
+setting_hashing = HashingSettings()
+setting_cache = CacheSettings()
+setting_rate_limit = RateLimitSettings()
+setting_webhook_queue = WebhookQueueSettings()
+setting_money = MoneySettings()
+setting_partition = PartitionSettings()
+
+
+def create_engine(url: str) -> AsyncEngine:
+    """Движок с настройками пула из setting_database, для primary и для реплик"""
+    new_engine = create_async_engine(
+        url=url,
+        echo=setting_database.echo,
+        poolclass=MetricsQueuePool,
+        pool_size=setting_database.pool_size,
+        max_overflow=setting_database.max_overflow,
+        pool_timeout=setting_database.pool_timeout,
+        pool_recycle=setting_database.pool_recycle,
+        pool_pre_ping=setting_database.pool_pre_ping,
+        connect_args={'prepared_statement_cache_size': setting_database.prepared_statement_cache_size},
+    )
+    instrument_engine(new_engine)
+    return new_engine
+
 
+engine = create_engine(setting_database.url)
+replica_engines = [create_engine(url) for url in setting_database.replica_urls]
+replica_router = ReplicaRouter(replica_engines,
+                               check_interval=setting_database.replica_check_interval,
+                               check_timeout=setting_database.replica_check_timeout)
 
-engine = create_async_engine(
-    url=setting_database.url,
-    echo=setting_database.echo
-)
+session_maker = async_sessionmaker(bind=engine, sync_session_class=RoutingSession, router=replica_router)
 
-session_maker = async_sessionmaker(bind=engine)
+# соединения родителя не должны использоваться в процессе после fork (gunicorn --preload и т.п.),
+# дочерний процесс откроет свой пул
+for _engine in [engine, *replica_engines]:
+    os.register_at_fork(after_in_child=partial(_engine.sync_engine.dispose, close=False))
 
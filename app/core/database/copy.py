@@ -0,0 +1,88 @@
+"""
+Чтение больших выборок целых чисел в массивы numpy через COPY ... TO STDOUT (FORMAT binary).
+
+Строки приходят потоком с сервера, как из серверного курсора, но без создания объекта Python на строку:
+у выборки из NOT NULL BIGINT колонок все строки одной длины, и пачка байт разбирается numpy целиком.
+"""
+import asyncio
+import struct
+from typing import AsyncIterator
+
+import numpy as np
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+COPY_TRAILER = b'\xff\xff'
+
+
+def _row_dtype(columns: int) -> np.dtype:
+    """Строка binary COPY: число полей int16, затем у каждого поля длина int32 и значение int64, big-endian"""
+    fields = [('fields', '>i2')]
+    for index in range(columns):
+        fields += [(f'length{index}', '>i4'), (f'value{index}', '>i8')]
+    return np.dtype(fields)
+
+
+async def stream_int64_rows(session: AsyncSession, query: Select, chunk_rows: int) -> AsyncIterator[np.ndarray]:
+    """
+    Отдаст результат query пачками до chunk_rows строк как массивы int64 формы (строки, колонки).
+    Все колонки query должны быть NOT NULL BIGINT. Пока пачку обрабатывают, COPY ждет, поэтому в памяти не больше пары пачек.
+    """
+    columns = len(query.selected_columns)
+    row_dtype = _row_dtype(columns)
+    chunk_bytes = chunk_rows * row_dtype.itemsize
+    compiled = query.compile(dialect=session.bind.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    connection = await session.connection()
+    driver_connection = (await connection.get_raw_connection()).driver_connection
+
+    chunks: asyncio.Queue[np.ndarray | BaseException | None] = asyncio.Queue(maxsize=1)
+    buffer = bytearray()
+    header_size: int | None = None
+
+    def parse(size: int) -> np.ndarray:
+        data = bytes(buffer[:size])
+        del buffer[:size]
+        rows = np.frombuffer(data, dtype=row_dtype)
+        if len(rows) and (np.any(rows['fields'] != columns) or any(np.any(rows[f'length{index}'] != 8)
+                                                                    for index in range(columns))):
+            raise ValueError('COPY rows must contain only NOT NULL BIGINT columns')
+        return np.stack([rows[f'value{index}'] for index in range(columns)], axis=1).astype(np.int64)
+
+    async def sink(data: bytes) -> None:
+        nonlocal header_size
+        buffer.extend(data)
+        if header_size is None:
+            if len(buffer) < 19:
+                return
+            if not buffer.startswith(COPY_SIGNATURE):
+                raise ValueError('unexpected COPY binary header')
+            header_size = 19 + struct.unpack('>I', buffer[15:19])[0]
+            del buffer[:header_size]
+        if len(buffer) >= chunk_bytes:
+            await chunks.put(parse(len(buffer) - len(buffer) % row_dtype.itemsize))
+
+    async def copy() -> None:
+        try:
+            await driver_connection.copy_from_query(str(compiled), *params, output=sink, format='binary')
+            if bytes(buffer[-2:]) != COPY_TRAILER:
+                raise ValueError('unexpected end of COPY binary stream')
+            del buffer[-2:]
+            if buffer:
+                await chunks.put(parse(len(buffer)))
+            await chunks.put(None)
+        except BaseException as error:
+            await chunks.put(error)
+            raise
+
+    task = asyncio.create_task(copy())
+    try:
+        while (chunk := await chunks.get()) is not None:
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+    finally:
+        if not task.done():
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -1,226 +1,780 @@
+from datetime import date, datetime
 from decimal import Decimal
+from typing import AsyncIterator
+
+import numpy as np
 
 from pydantic import EmailStr
-from sqlalchemy import select
+from sqlalchemy import Select, select, insert, update, delete, and_, tuple_, literal, bindparam, case, cast, func, BigInteger, Date, DateTime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.models import UserModel, PaymentModel, PaymentDateModel
-from app.core.config.config import session_maker
-from app.core.database.schemas import UserSchemas, ScoreSchemas, PaymentSchemas
+from app.api.models import UserModel, PrincipalModel, UserPublicModel, UserScoreModel, UserPageModel, PaymentModel, PaymentDateModel, PaymentPageModel, PaymentsTotalModel, ScoreModel, StatementModel, WebhookOutcomesModel
+from app.core.cache.cache import balance_cache, principal_cache, invalidate_on_commit
+from app.core.config.config import session_maker, setting_money
+from app.core.security.revocation import token_revocations
+from app.core.database.copy import stream_int64_rows
+from app.core.database.ledger import rollup_upsert
+from app.core.database.money import Money, amount_minor, from_minor, sum_minor
+from app.core.database.routing import READ_ONLY, read_only
+from app.core.database.schemas import UserSchemas, ScoreSchemas, PaymentSchemas, PaymentDailySchemas, PaymentTransactionSchemas, WebhookInboxSchemas, WebhookRejectionSchemas
 
 
 class UserCrud:
 
     @staticmethod
-    async def get_all_users() -> list[UserModel]:
-        """Вернет всех пользователей"""
+    def _users_query(role: str | None = None,
+                     state: bool | None = None,
+                     email_prefix: str | None = None
+                     ) -> Select:
+        """Запрос пользователей без колонки password с фильтрами, упорядочен по id"""
+        query = select(UserSchemas.id, UserSchemas.email, UserSchemas.first_name, UserSchemas.last_name,
+                       UserSchemas.state, UserSchemas.role).order_by(UserSchemas.id)
+        if role is not None:
+            query = query.where(UserSchemas.role == role)
+        if state is not None:
+            query = query.where(UserSchemas.state == state)
+        if email_prefix:
+            query = query.where(UserSchemas.email.startswith(email_prefix, autoescape=True))
+        return query
+
+    @staticmethod
+    @read_only
+    async def get_users_page(session: AsyncSession,
+                             after_id: int | None = None,
+                             limit: int = 100,
+                             role: str | None = None,
+                             state: bool | None = None,
+                             email_prefix: str | None = None
+                             ) -> UserPageModel:
+        """Вернет страницу пользователей после after_id (keyset пагинация по users.id)"""
+        query = UserCrud._users_query(role=role, state=state, email_prefix=email_prefix).limit(limit + 1)
+        if after_id is not None:
+            query = query.where(UserSchemas.id > after_id)
+        result = await session.execute(query)
+        users = [UserPublicModel.model_validate(row) for row in result]
+        next_cursor = None
+        if len(users) > limit:
+            users = users[:limit]
+            next_cursor = users[-1].id
+        return UserPageModel(items=users, next_cursor=next_cursor)
+
+    @staticmethod
+    async def stream_users(role: str | None = None,
+                           state: bool | None = None,
+                           email_prefix: str | None = None,
+                           chunk_size: int = 1000
+                           ) -> AsyncIterator[UserPublicModel]:
+        """
+        Отдаст пользователей по одному через серверный курсор, не загружая всю таблицу.
+        Открывает свою сессию: поток читается уже после того, как сессия запроса закрыта.
+        """
+        query = UserCrud._users_query(role=role, state=state, email_prefix=email_prefix)
         async with session_maker.begin() as session:
-            query = select(UserSchemas)
-            result = await session.execute(query)
-            users = result.scalars().all()
-            print(users)
-            return [UserModel.model_validate(user) for user in users]
+            session.info[READ_ONLY] = True
+            result = await session.stream(query.execution_options(yield_per=chunk_size))
+            async for row in result:
+                yield UserPublicModel.model_validate(row)
 
     @staticmethod
-    async def get_user_by_id(user_id: int) -> UserModel | dict[str, str]:
-        """Вернет пользователя по id"""
+    async def stream_users_with_scores(chunk_size: int = 1000) -> AsyncIterator[UserScoreModel]:
+        """
+        Отдаст пользователей со счетами через серверный курсор: строка на каждый счет,
+        пользователь без счетов - одна строка с пустым счетом. Открывает свою сессию, как stream_users.
+        """
+        query = (
+            select(UserSchemas.id, UserSchemas.email, UserSchemas.first_name, UserSchemas.last_name,
+                   UserSchemas.state, UserSchemas.role, ScoreSchemas.score_id, ScoreSchemas.score)
+            .outerjoin(ScoreSchemas, ScoreSchemas.user_id == UserSchemas.id)
+            .order_by(UserSchemas.id, ScoreSchemas.score_id)
+        )
         async with session_maker.begin() as session:
-            user = await session.get(UserSchemas, user_id)
-            if user:
-                return UserModel.model_validate(user)
-            return {'msg': 'user not found'}
+            session.info[READ_ONLY] = True
+            result = await session.stream(query.execution_options(yield_per=chunk_size))
+            async for row in result:
+                yield UserScoreModel.model_validate(row)
+
+    @staticmethod
+    async def create_users_batch(session: AsyncSession, users: list[UserModel]) -> list[str]:
+        """
+        Создаст пачку пользователей с начальными счетами двумя запросами (INSERT ... RETURNING).
+        Вернет статусы в порядке пользователей: created или duplicate email.
+        """
+        statuses = ['duplicate email'] * len(users)
+        unique: dict[str, int] = {}
+        for idx, user in enumerate(users):
+            unique.setdefault(user.email, idx)
+        if not unique:
+            return statuses
+
+        stmt = (
+            pg_insert(UserSchemas)
+            .on_conflict_do_nothing(index_elements=[UserSchemas.email])
+            .returning(UserSchemas.id, UserSchemas.email)
+        )
+        created = (await session.execute(stmt, [users[idx].model_dump() for idx in unique.values()])).all()
+        if not created:
+            return statuses
+
+        await session.execute(insert(ScoreSchemas), [{'score': Decimal('0.0'), 'user_id': user_id}
+                                                     for user_id, _ in created])
+        for _, email in created:
+            statuses[unique[email]] = 'created'
+        return statuses
 
     @staticmethod
-    async def get_user_id(email: EmailStr) -> int | dict[str, str]:
+    @read_only
+    async def get_user_by_id(session: AsyncSession, user_id: int) -> UserModel | dict[str, str]:
+        """Вернет пользователя по id"""
+        user = await session.get(UserSchemas, user_id)
+        if user:
+            return UserModel.model_validate(user)
+        return {'msg': 'user not found'}
+
+    @staticmethod
+    @read_only
+    async def get_user_id(session: AsyncSession, email: EmailStr) -> int | dict[str, str]:
         """Вернет id пользователя"""
-        async with session_maker.begin() as session:
-            query = select(UserSchemas).where(UserSchemas.email == email)
-            result = await session.execute(query)
-            user = result.scalar_one_or_none()
-            if user:
-                return user.id
-            return {'msg': 'user not found'}
+        query = select(UserSchemas).where(UserSchemas.email == email)
+        result = await session.execute(query)
+        user = result.scalar_one_or_none()
+        if user:
+            return user.id
+        return {'msg': 'user not found'}
 
     @staticmethod
-    async def get_user_email(user_id: int) -> int | dict[str, str]:
+    @read_only
+    async def get_user_email(session: AsyncSession, user_id: int) -> int | dict[str, str]:
         """Вернет email пользователя"""
-        async with session_maker.begin() as session:
-            user = await session.get(UserSchemas, user_id)
-            if user:
-                return user.email
-            return {'msg': 'user not found'}
+        user = await session.get(UserSchemas, user_id)
+        if user:
+            return user.email
+        return {'msg': 'user not found'}
 
     @staticmethod
-    async def get_user_by_email(email: str) -> UserModel | dict[str, str]:
-        """Вернет пользователя по email"""
-        async with session_maker.begin() as session:
-            query = select(UserSchemas).where(UserSchemas.email == email)
-            result = await session.execute(query)
-            user = result.scalar_one_or_none()
-            if user:
-                return UserModel.model_validate(user)
-            return {'msg': 'user not found'}
+    async def get_user_by_email(session: AsyncSession, email: str) -> PrincipalModel | dict[str, str]:
+        """
+        Вернет пользователя с id по email.
+        Читает из primary, не из реплики: по нему проверяются пароль при входе и пользователь токена,
+        отставшая реплика пустила бы по старому паролю, не нашла бы нового пользователя
+        и вернула бы в principal_cache уже сброшенные данные.
+        """
+        query = select(UserSchemas).where(UserSchemas.email == email)
+        result = await session.execute(query)
+        user = result.scalar_one_or_none()
+        if user:
+            return PrincipalModel.model_validate(user)
+        return {'msg': 'user not found'}
 
     @staticmethod
-    async def create_user(user_input: UserModel) -> dict[str, str]:
+    async def create_user(session: AsyncSession, user_input: UserModel) -> dict[str, str]:
         """Создаст пользователя"""
-        async with session_maker.begin() as session:
-            user = UserSchemas(**user_input.model_dump())
-            session.add(user)
-            await session.flush()
-            score = ScoreSchemas(score=Decimal('0.0'), user_id=user.id)
-            session.add(score)
-            return {'message': 'user was created'}
+        user = UserSchemas(**user_input.model_dump())
+        session.add(user)
+        await session.flush()
+        score = ScoreSchemas(score=Decimal('0.0'), user_id=user.id)
+        session.add(score)
+        return {'message': 'user was created'}
 
     @staticmethod
-    async def update_user(user_id: int, new_user: UserModel) -> dict[str, str]:
+    async def update_user(session: AsyncSession, user_id: int, new_user: UserModel) -> dict[str, str]:
         """Полностью обновит пользователя"""
-        async with session_maker.begin() as session:
-            stmt = select(UserSchemas).where(
-                UserSchemas.id == user_id
-            )
-            result = await session.execute(stmt)
-            user = result.scalar_one_or_none()
-            if user:
-                user = UserSchemas(**new_user.model_dump())
-                return {'msg': 'user was update'}
-            return {'msg': 'user not found'}
+        stmt = select(UserSchemas).where(
+            UserSchemas.id == user_id
+        )
+        result = await session.execute(stmt)
+        user = result.scalar_one_or_none()
+        if user:
+            invalidate_on_commit(session, principal_cache, user.email, new_user.email)
+            invalidate_on_commit(session, token_revocations, user.email, new_user.email)
+            for field, value in new_user.model_dump().items():
+                setattr(user, field, value)
+            return {'msg': 'user was update'}
+        return {'msg': 'user not found'}
 
     @staticmethod
-    async def patch_email_user_for_admin(new_email: EmailStr, old_email: EmailStr) -> dict[str, str]:
+    async def patch_email_user_for_admin(session: AsyncSession, new_email: EmailStr, old_email: EmailStr) -> dict[str, str]:
         """Обновит email пользователя"""
-        async with session_maker.begin() as session:
-            stmt = select(UserSchemas).where(
-                UserSchemas.email == old_email
-            )
-            result = await session.execute(stmt)
-            user = result.scalar_one_or_none()
-            if user:
-                user.email = new_email
-                return {'msg': 'email was update'}
-            return {'msg': 'user not found'}
+        stmt = select(UserSchemas).where(
+            UserSchemas.email == old_email
+        )
+        result = await session.execute(stmt)
+        user = result.scalar_one_or_none()
+        if user:
+            invalidate_on_commit(session, principal_cache, old_email, new_email)
+            invalidate_on_commit(session, token_revocations, old_email, new_email)
+            user.email = new_email
+            return {'msg': 'email was update'}
+        return {'msg': 'user not found'}
 
     @staticmethod
-    async def patch_email_user(new_email: EmailStr, old_email: EmailStr) -> dict[str, str]:
+    async def patch_email_user(session: AsyncSession, new_email: EmailStr, old_email: EmailStr) -> dict[str, str]:
         """Обновит email пользователя"""
-        async with session_maker.begin() as session:
-            stmt = select(UserSchemas).where(
-                UserSchemas.email == old_email
-            )
-            result = await session.execute(stmt)
-            user = result.scalar_one_or_none()
-            if user:
-                user.email = new_email
-                return {'msg': 'email was update'}
-            return {'msg': 'user not found'}
+        stmt = select(UserSchemas).where(
+            UserSchemas.email == old_email
+        )
+        result = await session.execute(stmt)
+        user = result.scalar_one_or_none()
+        if user:
+            invalidate_on_commit(session, principal_cache, old_email, new_email)
+            invalidate_on_commit(session, token_revocations, old_email, new_email)
+            user.email = new_email
+            return {'msg': 'email was update'}
+        return {'msg': 'user not found'}
 
     @staticmethod
-    async def patch_password(new_password: str, email: EmailStr) -> dict[str, str]:
+    async def patch_password(session: AsyncSession, new_password: str, email: EmailStr) -> dict[str, str]:
         """Обновит password пользователя"""
-        async with session_maker.begin() as session:
-            stmt = select(UserSchemas).where(
-                UserSchemas.email == email
-            )
-            result = await session.execute(stmt)
-            user = result.scalar_one_or_none()
-            if user:
-                user.password = new_password
-                return {'msg': 'password was update'}
-            return {'msg': 'user not found'}
+        stmt = select(UserSchemas).where(
+            UserSchemas.email == email
+        )
+        result = await session.execute(stmt)
+        user = result.scalar_one_or_none()
+        if user:
+            invalidate_on_commit(session, principal_cache, email)
+            invalidate_on_commit(session, token_revocations, email)
+            user.password = new_password
+            return {'msg': 'password was update'}
+        return {'msg': 'user not found'}
 
     @staticmethod
-    async def delete_user_by_id(user_id: int) -> dict[str, str]:
+    async def delete_user_by_id(session: AsyncSession, user_id: int) -> dict[str, str]:
         """Удалит пользователя из БД по id"""
-        async with session_maker.begin() as session:
-            user = await session.get(UserSchemas, user_id)
-
-            await session.delete(user)
-            return {'msg': 'user was deleted'}
+        user = await session.get(UserSchemas, user_id)
+        if not user:
+            return {'msg': 'user not found'}
+        invalidate_on_commit(session, principal_cache, user.email)
+        invalidate_on_commit(session, token_revocations, user.email)
+        invalidate_on_commit(session, balance_cache, user_id)
+        await session.delete(user)
+        return {'msg': 'user was deleted'}
 
     @staticmethod
-    async def disable_user(email: EmailStr) -> dict[str, str]:
-        async with session_maker.begin() as session:
-            query_user = select(UserSchemas).where(UserSchemas.email == email)
-            result = await session.execute(query_user)
-            user = result.scalar_one_or_none()
-            if user:
-                user.state = False
-                return {'message': 'user was disabled'}
-            return {'msg': 'user not found'}
+    async def disable_user(session: AsyncSession, email: EmailStr) -> dict[str, str]:
+        query_user = select(UserSchemas).where(UserSchemas.email == email)
+        result = await session.execute(query_user)
+        user = result.scalar_one_or_none()
+        if user:
+            invalidate_on_commit(session, principal_cache, email)
+            invalidate_on_commit(session, token_revocations, email)
+            user.state = False
+            return {'message': 'user was disabled'}
+        return {'msg': 'user not found'}
 
     @staticmethod
-    async def enable_user(email: EmailStr) -> dict[str, str]:
-        async with session_maker.begin() as session:
-            query_user = select(UserSchemas).where(UserSchemas.email == email)
-            result = await session.execute(query_user)
-            user = result.scalar_one_or_none()
-            if user:
-                user.state = True
-                return {'message': 'user was enabled'}
-            return {'msg': 'user not found'}
+    async def enable_user(session: AsyncSession, email: EmailStr) -> dict[str, str]:
+        query_user = select(UserSchemas).where(UserSchemas.email == email)
+        result = await session.execute(query_user)
+        user = result.scalar_one_or_none()
+        if user:
+            invalidate_on_commit(session, principal_cache, email)
+            invalidate_on_commit(session, token_revocations, email)
+            user.state = True
+            return {'message': 'user was enabled'}
+        return {'msg': 'user not found'}
 
 
 class ScoreCrud:
 
     @staticmethod
-    async def get_user_scores(email: EmailStr) -> dict:
-        """Получить счета пользователя"""
+    async def _load_user_scores(session: AsyncSession,
+                                email: EmailStr | None = None,
+                                user_id: int | None = None
+                                ) -> list[ScoreModel]:
+        """Счета пользователя одним запросом: по id напрямую, по email через JOIN с users"""
+        query = select(ScoreSchemas.score_id, ScoreSchemas.score).order_by(ScoreSchemas.score_id)
+        if user_id is not None:
+            query = query.where(ScoreSchemas.user_id == user_id)
+        else:
+            query = query.join(UserSchemas, UserSchemas.id == ScoreSchemas.user_id).where(UserSchemas.email == email)
+        result = await session.execute(query)
+        return [ScoreModel.model_validate(row) for row in result]
+
+    @staticmethod
+    @read_only
+    async def get_user_scores(session: AsyncSession,
+                              email: EmailStr | None = None,
+                              user_id: int | None = None
+                              ) -> list[ScoreModel]:
+        """Получить счета пользователя, чтение можно выполнить на реплике"""
+        return await ScoreCrud._load_user_scores(session, email=email, user_id=user_id)
+
+    @staticmethod
+    async def get_user_scores_cached(session: AsyncSession, user_id: int) -> list[ScoreModel]:
+        """
+        Счета пользователя из balance_cache, при промахе загрузит их из primary:
+        сброс кеша срабатывает при коммите зачисления, и отставшая реплика вернула бы в кеш старый баланс
+        """
+        scores = balance_cache.get(user_id)
+        if scores is None:
+            epoch = balance_cache.epoch
+            scores = await ScoreCrud._load_user_scores(session, user_id=user_id)
+            balance_cache.set(user_id, scores, epoch=epoch)
+        return scores
+
+    @staticmethod
+    async def stream_balances(chunk_size: int = 50_000) -> AsyncIterator[np.ndarray]:
+        """
+        Отдаст все счета пачками массивов int64 (score_id, user_id, баланс в минимальных единицах) через COPY.
+        Открывает свою сессию, как UserCrud.stream_users.
+        """
+        query = select(cast(ScoreSchemas.score_id, BigInteger), cast(ScoreSchemas.user_id, BigInteger),
+                       amount_minor(ScoreSchemas.score))
         async with session_maker.begin() as session:
-            user_id = await UserCrud.get_user_id(email=email)
-            query = select(ScoreSchemas).where(ScoreSchemas.user_id == user_id)
-            result = await session.execute(query)
-            scores = result.scalars()
-            if scores:
-                return {idx: score.score for idx, score in enumerate(scores)}
-            return {'msg': 'scores not found'}
+            session.info[READ_ONLY] = True
+            async for chunk in stream_int64_rows(session, query, chunk_size):
+                yield chunk
 
     @staticmethod
-    async def create_new_score(email: EmailStr) -> dict[str, str]:
+    async def create_new_score(session: AsyncSession, email: EmailStr) -> dict[str, str]:
         """Создаст новый счет пользователя"""
-        async with session_maker.begin() as session:
-            user_id = await UserCrud.get_user_id(email=email)
-            score = ScoreSchemas(score=Decimal('0.0'), user_id=user_id)
-            session.add(score)
-            return {'msg': 'score was created'}
+        user_id = await UserCrud.get_user_id(session, email=email)
+        score = ScoreSchemas(score=Decimal('0.0'), user_id=user_id)
+        session.add(score)
+        invalidate_on_commit(session, balance_cache, user_id)
+        return {'msg': 'score was created'}
 
     @staticmethod
-    async def delete_score_user(email: EmailStr) -> dict[str, str]:
-        """Удалит счет пользователя"""
-        async with session_maker.begin() as session:
-            query = select(UserSchemas).where(UserSchemas.email == email).subquery()
-            result = await session.execute(query)
-            user = result.scalar_one_or_none()
-            if user:
-                await session.delete(ScoreSchemas, user.id)
-                await session.delete(PaymentSchemas, user.id)
-                return {'msg': 'score was deleted'}
+    async def delete_score_user(session: AsyncSession, email: EmailStr) -> dict[str, str]:
+        """Удалит счета пользователя; платежи остаются в истории (по ним строятся итоги и проверка повторов)"""
+        user_id = select(UserSchemas.id).where(UserSchemas.email == email).scalar_subquery()
+        stmt = (
+            delete(ScoreSchemas)
+            .where(ScoreSchemas.user_id == user_id)
+            .returning(ScoreSchemas.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        deleted = (await session.execute(stmt)).scalars().first()
+        if deleted is None:
             return {'msg': 'score not found'}
+        invalidate_on_commit(session, balance_cache, deleted)
+        return {'msg': 'score was deleted'}
 
 
 class PaymentCrud:
     @staticmethod
-    async def transfer_money(amount: Decimal,
+    async def transfer_money(session: AsyncSession,
+                             amount: Decimal,
                              user_id: int,
                              score_id: int,
                              payment: PaymentModel
                              ) -> dict[str, str]:
-        """Зачислить деньги на счет"""
-        async with session_maker.begin() as session:
-            query = select(ScoreSchemas).filter_by(score_id=score_id, user_id=user_id)
-            result_for_score = await session.execute(query)
-            score = result_for_score.scalar_one_or_none()
-            if score:
-                score.score += amount
-                pay = PaymentSchemas(**payment.model_dump())
-                session.add(pay)
-                return {'msg': 'the money is credited'}
-            return {'msg': 'score not found'}
+        """
+        Зачислить деньги на счет.
+        Вставка платежа, зачисление и дневные итоги счета обновляются одним запросом (CTE).
+        Повторный transaction_id отсекается ON CONFLICT DO NOTHING в payment_transactions,
+        баланс увеличивается атомарно в самой БД.
+        """
+        score_matches = (ScoreSchemas.score_id == score_id, ScoreSchemas.user_id == user_id)
+        claimed = (
+            pg_insert(PaymentTransactionSchemas)
+            .from_select(
+                ['transaction_id', 'datetime_payment'],
+                select(literal(payment.transaction_id), literal(datetime.now(), DateTime())).where(*score_matches)
+            )
+            .on_conflict_do_nothing(index_elements=[PaymentTransactionSchemas.transaction_id])
+            .returning(PaymentTransactionSchemas.transaction_id, PaymentTransactionSchemas.datetime_payment)
+            .cte('claimed')
+        )
+        inserted = (
+            pg_insert(PaymentSchemas)
+            .from_select(
+                ['transaction_id', 'score_id', 'user_id', 'amount', 'signature', 'datetime_payment'],
+                select(
+                    claimed.c.transaction_id,
+                    ScoreSchemas.score_id,
+                    ScoreSchemas.user_id,
+                    literal(amount, Money()),
+                    literal(payment.signature),
+                    claimed.c.datetime_payment,
+                ).select_from(claimed.join(ScoreSchemas, and_(*score_matches)))
+            )
+            .returning(PaymentSchemas.score_id, PaymentSchemas.user_id, PaymentSchemas.amount,
+                       PaymentSchemas.datetime_payment)
+            .cte('inserted')
+        )
+        rollup = rollup_upsert(select(
+            inserted.c.score_id,
+            cast(inserted.c.datetime_payment, Date),
+            inserted.c.user_id,
+            inserted.c.amount,
+            literal(1),
+            inserted.c.datetime_payment,
+            inserted.c.datetime_payment,
+        )).cte('rollup')
+        stmt = (
+            update(ScoreSchemas)
+            .add_cte(rollup)
+            .where(ScoreSchemas.score_id == inserted.c.score_id)
+            .values(score=ScoreSchemas.score + inserted.c.amount)
+            .returning(ScoreSchemas.score)
+            .execution_options(synchronize_session=False)
+        )
+        balance = (await session.execute(stmt)).scalar_one_or_none()
+        if balance is not None:
+            invalidate_on_commit(session, balance_cache, user_id)
+            return {'msg': 'the money is credited', 'score': str(balance)}
+
+        query = select(PaymentTransactionSchemas.transaction_id).where(
+            PaymentTransactionSchemas.transaction_id == payment.transaction_id
+        )
+        if (await session.execute(query)).first():
+            return {'msg': 'transaction already processed'}
+        return {'msg': 'score not found'}
 
     @staticmethod
-    async def get_all_payments(user_id: int) -> list[PaymentModel]:
-        """Вернет платежи пользователя"""
+    async def transfer_money_batch(session: AsyncSession, payments: list[PaymentModel]) -> list[str]:
+        """
+        Зачислить пачку платежей одной транзакцией.
+        Вернет статусы в порядке платежей: credited, duplicate или unknown score.
+        """
+        statuses = ['duplicate'] * len(payments)
+        unique: dict[int, int] = {}
+        for idx, payment in enumerate(payments):
+            unique.setdefault(payment.transaction_id, idx)
+        if not unique:
+            return statuses
+
+        query = select(ScoreSchemas.score_id, ScoreSchemas.user_id).where(
+            ScoreSchemas.score_id.in_({payment.score_id for payment in payments})
+        )
+        known_scores = set((await session.execute(query)).tuples())
+
+        rows = {}
+        for idx in unique.values():
+            payment = payments[idx]
+            if (payment.score_id, payment.user_id) in known_scores:
+                rows[idx] = {**payment.model_dump(), 'datetime_payment': datetime.now()}
+            else:
+                statuses[idx] = 'unknown score'
+        if not rows:
+            return statuses
+
+        stmt = (
+            pg_insert(PaymentTransactionSchemas)
+            .on_conflict_do_nothing(index_elements=[PaymentTransactionSchemas.transaction_id])
+            .returning(PaymentTransactionSchemas.transaction_id)
+        )
+        # ключи в одном порядке, чтобы параллельные пачки с общими transaction_id не ловили deadlock
+        claimed = sorted(rows.values(), key=lambda row: row['transaction_id'])
+        inserted = set((await session.scalars(stmt, [
+            {'transaction_id': row['transaction_id'], 'datetime_payment': row['datetime_payment']} for row in claimed
+        ])).all())
+        if inserted:
+            await session.execute(insert(PaymentSchemas),
+                                  [row for row in claimed if row['transaction_id'] in inserted])
+
+        totals: dict[int, Decimal] = {}
+        daily: dict[tuple[int, date], dict] = {}
+        credited_users = set()
+        for idx, row in rows.items():
+            if row['transaction_id'] in inserted:
+                statuses[idx] = 'credited'
+                totals[row['score_id']] = totals.get(row['score_id'], Decimal('0')) + row['amount']
+                credited_users.add(row['user_id'])
+                key = (row['score_id'], row['datetime_payment'].date())
+                day = daily.get(key)
+                if day is None:
+                    daily[key] = {'score_id': key[0], 'day': key[1], 'user_id': row['user_id'],
+                                  'total_amount': row['amount'], 'payments_count': 1,
+                                  'first_payment': row['datetime_payment'], 'last_payment': row['datetime_payment']}
+                else:
+                    day['total_amount'] += row['amount']
+                    day['payments_count'] += 1
+                    day['last_payment'] = max(day['last_payment'], row['datetime_payment'])
+
+        if totals:
+            invalidate_on_commit(session, balance_cache, *credited_users)
+            scores = ScoreSchemas.__table__
+            stmt = (
+                update(scores)
+                .where(scores.c.score_id == bindparam('b_score_id'))
+                .values(score=scores.c.score + bindparam('b_total', type_=Money()))
+            )
+            # одинаковый порядок блокировок строк, чтобы параллельные пачки не ловили deadlock
+            await session.execute(stmt, [{'b_score_id': score_id, 'b_total': totals[score_id]}
+                                         for score_id in sorted(totals)])
+            await session.execute(rollup_upsert(), [daily[key] for key in sorted(daily)])
+        return statuses
+
+    @staticmethod
+    @read_only
+    async def get_payments_page(session: AsyncSession,
+                                user_id: int,
+                                date_from: datetime | None = None,
+                                date_to: datetime | None = None,
+                                score_id: int | None = None,
+                                before_datetime: datetime | None = None,
+                                before_id: int | None = None,
+                                limit: int = 100
+                                ) -> PaymentPageModel:
+        """
+        Вернет страницу платежей пользователя от новых к старым.
+        Keyset пагинация по (user_id, datetime_payment, payment_id) идет по индексу
+        ix_payments_user_id_datetime_payment.
+        """
+        query = (
+            select(PaymentSchemas)
+            .where(PaymentSchemas.user_id == user_id)
+            .order_by(PaymentSchemas.datetime_payment.desc(), PaymentSchemas.payment_id.desc())
+            .limit(limit + 1)
+        )
+        if date_from is not None:
+            query = query.where(PaymentSchemas.datetime_payment >= date_from)
+        if date_to is not None:
+            query = query.where(PaymentSchemas.datetime_payment < date_to)
+        if score_id is not None:
+            query = query.where(PaymentSchemas.score_id == score_id)
+        if before_datetime is not None and before_id is not None:
+            query = query.where(
+                tuple_(PaymentSchemas.datetime_payment, PaymentSchemas.payment_id) < tuple_(before_datetime, before_id)
+            )
+        result = await session.scalars(query)
+        payments = [PaymentDateModel.model_validate(payment) for payment in result]
+        if len(payments) <= limit:
+            return PaymentPageModel(items=payments)
+        last = payments[limit - 1]
+        return PaymentPageModel(items=payments[:limit], next_datetime=last.datetime_payment, next_id=last.payment_id)
+
+    @staticmethod
+    @read_only
+    async def get_payments_total(session: AsyncSession,
+                                 date_from: datetime | None = None,
+                                 date_to: datetime | None = None,
+                                 score_id: int | None = None,
+                                 chunk_size: int = 10_000
+                                 ) -> PaymentsTotalModel:
+        """
+        Сумма и число платежей за период по всем пользователям.
+        В минимальных единицах суммы читаются серверным курсором пачками по chunk_size и складываются numpy,
+        поэтому память не зависит от числа платежей и на строку не создается Decimal.
+        В режиме NUMERIC сумма считается в БД: так она точна и для старых сумм точнее минимальной единицы.
+        """
+        conditions = []
+        if date_from is not None:
+            conditions.append(PaymentSchemas.datetime_payment >= date_from)
+        if date_to is not None:
+            conditions.append(PaymentSchemas.datetime_payment < date_to)
+        if score_id is not None:
+            conditions.append(PaymentSchemas.score_id == score_id)
+        if not setting_money.minor_units:
+            query = select(func.coalesce(func.sum(PaymentSchemas.amount), 0), func.count()).where(*conditions)
+            total_amount, count = (await session.execute(query)).one()
+            return PaymentsTotalModel(total_amount=total_amount, payments_count=count)
+
+        query = select(amount_minor(PaymentSchemas.amount)).where(*conditions)
+        total = count = 0
+        result = await session.stream_scalars(query.execution_options(yield_per=chunk_size))
+        async for chunk in result.partitions():
+            total += sum_minor(chunk)
+            count += len(chunk)
+        return PaymentsTotalModel(total_amount=from_minor(total), payments_count=count)
+
+    @staticmethod
+    async def stream_payment_amounts(date_from: datetime,
+                                     date_to: datetime,
+                                     chunk_size: int = 50_000
+                                     ) -> AsyncIterator[np.ndarray]:
+        """
+        Отдаст платежи за [date_from, date_to) пачками массивов int64 (unix время платежа,
+        сумма в минимальных единицах) через COPY. Открывает свою сессию, как UserCrud.stream_users.
+        """
+        query = (
+            select(cast(func.extract('epoch', PaymentSchemas.datetime_payment), BigInteger),
+                   amount_minor(PaymentSchemas.amount))
+            .where(PaymentSchemas.datetime_payment >= date_from, PaymentSchemas.datetime_payment < date_to)
+        )
         async with session_maker.begin() as session:
-            query = select(PaymentSchemas).where(PaymentSchemas.user_id == user_id)
-            result = await session.execute(query)
-            payments = result.scalars().all()
-            return [PaymentDateModel.model_validate(payment) for payment in payments]
+            session.info[READ_ONLY] = True
+            async for chunk in stream_int64_rows(session, query, chunk_size):
+                yield chunk
 
+    @staticmethod
+    @read_only
+    async def get_statement(session: AsyncSession,
+                            user_id: int,
+                            date_from: date,
+                            date_to: date,
+                            score_id: int | None = None
+                            ) -> list[StatementModel]:
+        """
+        Вернет итоги зачислений по счетам пользователя за дни [date_from, date_to).
+        Читает дневные итоги payments_daily по индексу ix_payments_daily_user_id_day, а не сами платежи.
+        """
+        query = (
+            select(PaymentDailySchemas.score_id,
+                   func.sum(PaymentDailySchemas.total_amount).label('total_amount'),
+                   func.sum(PaymentDailySchemas.payments_count).label('payments_count'),
+                   func.min(PaymentDailySchemas.first_payment).label('first_payment'),
+                   func.max(PaymentDailySchemas.last_payment).label('last_payment'))
+            .where(PaymentDailySchemas.user_id == user_id,
+                   PaymentDailySchemas.day >= date_from,
+                   PaymentDailySchemas.day < date_to)
+            .group_by(PaymentDailySchemas.score_id)
+            .order_by(PaymentDailySchemas.score_id)
+        )
+        if score_id is not None:
+            query = query.where(PaymentDailySchemas.score_id == score_id)
+        result = await session.execute(query)
+        return [StatementModel.model_validate(row, from_attributes=True) for row in result]
+
+
+class InboxCrud:
+
+    @staticmethod
+    async def enqueue(session: AsyncSession, payment: PaymentModel) -> dict[str, str]:
+        """Сохранит вебхук в очередь; повторный transaction_id не добавляется, а увеличивает received_count"""
+        now = datetime.now()
+        stmt = (
+            pg_insert(WebhookInboxSchemas)
+            .values(**payment.model_dump(), received_at=now, available_at=now)
+            .on_conflict_do_update(
+                index_elements=[WebhookInboxSchemas.transaction_id],
+                set_={'received_count': WebhookInboxSchemas.received_count + 1},
+            )
+            .returning(WebhookInboxSchemas.received_count)
+        )
+        if (await session.execute(stmt)).scalar_one() > 1:
+            return {'msg': 'transaction already accepted'}
+        return {'msg': 'accepted'}
+
+    @staticmethod
+    async def record_rejections(session: AsyncSession, counts: dict[tuple[datetime, str, str], int]) -> None:
+        """
+        Прибавит к почасовым счетчикам webhook_rejections накопленные в процессе отказы.
+        counts - {(час, source, причина): число}, пишется одним запросом на весь сброс.
+        """
+        rows = [{'hour': hour, 'source': source, 'reason': reason, 'count': count}
+                for (hour, source, reason), count in sorted(counts.items()) if count]
+        if not rows:
+            return
+        stmt = pg_insert(WebhookRejectionSchemas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[WebhookRejectionSchemas.hour, WebhookRejectionSchemas.source, WebhookRejectionSchemas.reason],
+            set_={'count': WebhookRejectionSchemas.count + stmt.excluded.count},
+        )
+        await session.execute(stmt, rows)
+
+    @staticmethod
+    async def claim_batch(session: AsyncSession, limit: int) -> list[WebhookInboxSchemas]:
+        """
+        Заберет до limit готовых к обработке событий, самые давние первыми.
+        Строки блокируются до конца транзакции, SKIP LOCKED пропускает строки, занятые другими воркерами.
+        """
+        query = (
+            select(WebhookInboxSchemas)
+            .where(WebhookInboxSchemas.status == 'pending', WebhookInboxSchemas.available_at <= datetime.now())
+            .order_by(WebhookInboxSchemas.available_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        return list((await session.scalars(query)).all())
+
+    @staticmethod
+    def complete(events: list[WebhookInboxSchemas], results: list[str]) -> None:
+        """Отметит обработанные события; unknown score повторять бессмысленно, такие события уходят в dead"""
+        now = datetime.now()
+        for event, result in zip(events, results):
+            event.status = 'dead' if result == 'unknown score' else 'done'
+            event.result = result
+            event.attempts += 1
+            event.processed_at = now
+
+    @staticmethod
+    async def fail(session: AsyncSession,
+                   event_ids: list[int],
+                   error: str,
+                   max_attempts: int,
+                   retry_base_seconds: float,
+                   retry_max_seconds: float
+                   ) -> None:
+        """Отложит события с экспоненциальной задержкой, после max_attempts попыток переведет в dead"""
+        delay = func.least(retry_base_seconds * func.power(2, WebhookInboxSchemas.attempts), retry_max_seconds)
+        stmt = (
+            update(WebhookInboxSchemas)
+            .where(WebhookInboxSchemas.id.in_(event_ids))
+            .values(
+                attempts=WebhookInboxSchemas.attempts + 1,
+                status=case((WebhookInboxSchemas.attempts + 1 >= max_attempts, 'dead'), else_='pending'),
+                available_at=literal(datetime.now(), DateTime()) + func.make_interval(0, 0, 0, 0, 0, 0, delay),
+                last_error=error[:1000],
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(stmt)
+
+    @staticmethod
+    async def get_inbox_stats(session: AsyncSession) -> dict[str, int | float]:
+        """Число событий по статусам и возраст самого давнего необработанного события в секундах"""
+        query = (
+            select(WebhookInboxSchemas.status, func.count(), func.min(WebhookInboxSchemas.received_at))
+            .group_by(WebhookInboxSchemas.status)
+        )
+        stats: dict[str, int | float] = {'pending': 0, 'done': 0, 'dead': 0, 'lag_seconds': 0.0}
+        for event_status, count, oldest in await session.execute(query):
+            stats[event_status] = count
+            if event_status == 'pending':
+                stats['lag_seconds'] = round((datetime.now() - oldest).total_seconds(), 3)
+        return stats
+
+    @staticmethod
+    @read_only
+    async def get_webhook_outcomes(session: AsyncSession,
+                                   date_from: datetime,
+                                   date_to: datetime,
+                                   credited: int
+                                   ) -> WebhookOutcomesModel:
+        """
+        Исходы всех вебхуков, полученных за [date_from, date_to).
+        credited - число платежей за период: каждый платеж зачислен ровно одним вебхуком.
+        Повторы и отказы берутся из очереди (received_count, dead) и почасовых счетчиков webhook_rejections.
+        """
+        counts = {'credited': credited, 'duplicate': 0, 'failed': 0, 'bad_signature': 0, 'pending': 0}
+        query = (
+            select(WebhookInboxSchemas.status, WebhookInboxSchemas.result, func.count(),
+                   func.sum(WebhookInboxSchemas.received_count - 1))
+            .where(WebhookInboxSchemas.received_at >= date_from, WebhookInboxSchemas.received_at < date_to)
+            .group_by(WebhookInboxSchemas.status, WebhookInboxSchemas.result)
+        )
+        for event_status, result, count, retries in await session.execute(query):
+            counts['duplicate'] += retries
+            if event_status == 'dead':
+                counts['failed'] += count
+            elif event_status == 'pending':
+                counts['pending'] += count
+            elif result == 'duplicate':
+                counts['duplicate'] += count
+
+        query = (
+            select(WebhookRejectionSchemas.reason, func.sum(WebhookRejectionSchemas.count))
+            .where(WebhookRejectionSchemas.hour >= date_from.replace(minute=0, second=0, microsecond=0),
+                   WebhookRejectionSchemas.hour < date_to)
+            .group_by(WebhookRejectionSchemas.reason)
+        )
+        for reason, count in await session.execute(query):
+            if reason == 'duplicate':
+                counts['duplicate'] += count
+            else:
+                counts['failed'] += count
+                if reason == 'bad signature':
+                    counts['bad_signature'] += count
+
+        received = counts['credited'] + counts['duplicate'] + counts['failed'] + counts['pending']
+        return WebhookOutcomesModel(
+            received=received,
+            duplicate_rate=counts['duplicate'] / received if received else 0.0,
+            failed_rate=counts['failed'] / received if received else 0.0,
+            **counts,
+        )
+
+    @staticmethod
+    async def requeue_dead(session: AsyncSession) -> dict[str, str]:
+        """Вернет события из dead в очередь с обнулением попыток"""
+        stmt = (
+            update(WebhookInboxSchemas)
+            .where(WebhookInboxSchemas.status == 'dead')
+            .values(status='pending', attempts=0, available_at=datetime.now(), result=None)
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(stmt)
+        return {'msg': f'{result.rowcount} events requeued'}
@@ -0,0 +1,96 @@
+"""
+Дневные итоги зачислений по счетам (таблица payments_daily).
+
+Зачисления обновляют итоги в своей транзакции (см. PaymentCrud.transfer_money), а для уже накопленной
+истории итоги пересчитываются командой:
+    python -m app.core.database.ledger --from 2024-01-01 --to 2025-01-01
+Без --from/--to пересчитывается вся история платежей.
+"""
+import argparse
+import asyncio
+from datetime import date, datetime, time
+
+from sqlalchemy import Date, Insert, Select, cast, delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.core.config.config import session_maker
+from app.core.database.schemas import PaymentDailySchemas, PaymentSchemas
+
+ROLLUP_COLUMNS = ['score_id', 'day', 'user_id', 'total_amount', 'payments_count', 'first_payment', 'last_payment']
+
+
+def rollup_upsert(rows: Select | None = None) -> Insert:
+    """
+    INSERT в payments_daily, который прибавляет к итогам дня, если строка за этот день уже есть.
+    rows - select с колонками ROLLUP_COLUMNS; без него значения передаются параметрами.
+    """
+    stmt = pg_insert(PaymentDailySchemas)
+    if rows is not None:
+        stmt = stmt.from_select(ROLLUP_COLUMNS, rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[PaymentDailySchemas.score_id, PaymentDailySchemas.day],
+        set_={
+            'total_amount': PaymentDailySchemas.total_amount + stmt.excluded.total_amount,
+            'payments_count': PaymentDailySchemas.payments_count + stmt.excluded.payments_count,
+            'first_payment': func.least(PaymentDailySchemas.first_payment, stmt.excluded.first_payment),
+            'last_payment': func.greatest(PaymentDailySchemas.last_payment, stmt.excluded.last_payment),
+        },
+    )
+
+
+def _month_starts(date_from: date, date_to: date) -> list[date]:
+    """Границы месяцев от date_from до date_to включительно"""
+    bounds = [date_from]
+    current = date_from.replace(day=1)
+    while True:
+        current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+        if current >= date_to:
+            break
+        bounds.append(current)
+    bounds.append(date_to)
+    return bounds
+
+
+async def backfill(date_from: date | None = None, date_to: date | None = None) -> int:
+    """
+    Пересчитает payments_daily по payments за дни [date_from, date_to), по месяцу на транзакцию.
+    На время пересчета месяца таблица итогов блокируется от зачислений, поэтому платеж,
+    который коммитится параллельно, попадет в итоги ровно один раз. Вернет число строк итогов.
+    """
+    if date_from is None or date_to is None:
+        async with session_maker.begin() as session:
+            first_day, last_day = (await session.execute(
+                select(func.min(PaymentSchemas.datetime_payment), func.max(PaymentSchemas.datetime_payment))
+            )).one()
+        if first_day is None:
+            return 0
+        date_from = date_from or first_day.date()
+        date_to = date_to or date.fromordinal(last_day.date().toordinal() + 1)
+
+    day = cast(PaymentSchemas.datetime_payment, Date)
+    rows = 0
+    bounds = _month_starts(date_from, date_to)
+    for start, end in zip(bounds, bounds[1:]):
+        async with session_maker.begin() as session:
+            await session.execute(text('LOCK TABLE payments_daily IN SHARE ROW EXCLUSIVE MODE'))
+            await session.execute(
+                delete(PaymentDailySchemas).where(PaymentDailySchemas.day >= start, PaymentDailySchemas.day < end)
+            )
+            totals = (
+                select(PaymentSchemas.score_id, day, func.min(PaymentSchemas.user_id), func.sum(PaymentSchemas.amount),
+                       func.count(), func.min(PaymentSchemas.datetime_payment), func.max(PaymentSchemas.datetime_payment))
+                .where(PaymentSchemas.datetime_payment >= datetime.combine(start, time.min),
+                       PaymentSchemas.datetime_payment < datetime.combine(end, time.min))
+                .group_by(PaymentSchemas.score_id, day)
+            )
+            result = await session.execute(pg_insert(PaymentDailySchemas).from_select(ROLLUP_COLUMNS, totals))
+            rows += result.rowcount
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Пересчет дневных итогов зачислений по истории платежей')
+    parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='первый день, по умолчанию начало истории')
+    parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='день после последнего, по умолчанию конец истории')
+    args = parser.parse_args()
+    print(f'rows: {asyncio.run(backfill(args.date_from, args.date_to))}')
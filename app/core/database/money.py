@@ -0,0 +1,157 @@
+"""
+Денежные суммы в БД: NUMERIC или, при MONEY_MINOR_UNITS=true, BIGINT в минимальных единицах валюты.
+Код приложения в обоих режимах работает с Decimal, перевод в минимальные единицы делает тип Money.
+
+Колонки переводятся под текущее значение MONEY_MINOR_UNITS командой (повторный запуск ничего не меняет,
+на время перевода таблицы блокируются, приложение нужно остановить):
+    MONEY_MINOR_UNITS=true python -m app.core.database.money
+"""
+import argparse
+import asyncio
+from decimal import Decimal
+from typing import Any, Sequence
+
+import numpy as np
+from sqlalchemy import BigInteger, ColumnElement, Numeric, cast, text, type_coerce
+from sqlalchemy.types import TypeDecorator, TypeEngine
+
+from app.core.config.config import engine, setting_money, MoneySettings
+
+INT64_MAX = int(np.iinfo(np.int64).max)
+
+# колонки с суммами, которые переводит convert_storage
+MONEY_COLUMNS = [
+    ('scores', 'score'),
+    ('payments', 'amount'),
+    ('payments_daily', 'total_amount'),
+    ('webhook_inbox', 'amount'),
+]
+
+
+def to_minor(amount: Decimal, settings: MoneySettings = setting_money) -> int:
+    """Сумма в минимальных единицах; сумма с долями меньше минимальной единицы - ошибка"""
+    scaled = amount.scaleb(settings.precision)
+    if scaled != scaled.to_integral_value():
+        raise ValueError(f'amount {amount} has more than {settings.precision} decimal places')
+    return int(scaled)
+
+
+def from_minor(value: int | Decimal, settings: MoneySettings = setting_money) -> Decimal:
+    """Decimal из минимальных единиц (sum по BIGINT в postgres возвращает numeric, поэтому и Decimal)"""
+    return Decimal(int(value)).scaleb(-settings.precision)
+
+
+def check_precision(amount: Decimal) -> Decimal:
+    """
+    Валидатор pydantic: сумма должна точно переводиться в минимальные единицы в обоих режимах,
+    иначе в режиме NUMERIC отчеты в минимальных единицах (amount_minor) разошлись бы с sum(amount)
+    """
+    to_minor(amount)
+    return amount
+
+
+class Money(TypeDecorator):
+    """Decimal в Python; в БД NUMERIC или BIGINT в минимальных единицах в зависимости от setting_money"""
+    impl = Numeric
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect) -> TypeEngine:
+        if setting_money.minor_units:
+            return dialect.type_descriptor(BigInteger())
+        return dialect.type_descriptor(Numeric())
+
+    def process_bind_param(self, value: Decimal | None, dialect) -> Any:
+        if value is None or not setting_money.minor_units:
+            return value
+        return to_minor(Decimal(value))
+
+    def process_result_value(self, value: Any, dialect) -> Decimal | None:
+        if value is None or not setting_money.minor_units:
+            return value
+        return from_minor(value)
+
+
+def amount_minor(column: ColumnElement) -> ColumnElement:
+    """
+    SQL выражение: сумма в минимальных единицах как BIGINT, без перевода в Decimal при чтении.
+    В режиме NUMERIC сумма точнее минимальной единицы (записанная до проверки точности в API) округляется,
+    такие строки покажет python -m app.core.database.money --check.
+    """
+    if setting_money.minor_units:
+        return type_coerce(column, BigInteger)
+    return cast(column * 10 ** setting_money.precision, BigInteger)
+
+
+def sum_minor(values: Sequence[int] | np.ndarray) -> int:
+    """
+    Сумма пачки сумм в минимальных единицах: numpy складывает int64 без создания Decimal на строку.
+    Если сумма пачки может не поместиться в int64, пачка складывается в int Python.
+    """
+    if not len(values):
+        return 0
+    array = values if isinstance(values, np.ndarray) else np.fromiter(values, dtype=np.int64, count=len(values))
+    if int(np.abs(array).max()) * len(array) > INT64_MAX:
+        return sum(int(value) for value in array)
+    return int(array.sum())
+
+
+def conversion_statements(bigint_columns: set[tuple[str, str]],
+                          minor_units: bool,
+                          settings: MoneySettings = setting_money
+                          ) -> list[str]:
+    """
+    SQL перевода MONEY_COLUMNS в BIGINT минимальных единиц (minor_units) или обратно в NUMERIC.
+    bigint_columns - колонки, которые сейчас BIGINT; колонки уже нужного типа пропускаются.
+    """
+    factor = 10 ** settings.precision
+    statements = []
+    for table, column in MONEY_COLUMNS:
+        if ((table, column) in bigint_columns) == minor_units:
+            continue
+        if minor_units:
+            # суммы точнее минимальной единицы не переводятся молча: перевод упадет и откатится целиком
+            statements.append(
+                f'DO $$ BEGIN IF EXISTS (SELECT 1 FROM {table} WHERE {column} * {factor} <> trunc({column} * {factor})) '
+                f"THEN RAISE EXCEPTION '{table}.{column} has amounts finer than 1/{factor}'; END IF; END $$"
+            )
+            statements.append(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT USING ({column} * {factor})::bigint')
+        else:
+            statements.append(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE NUMERIC '
+                              f'USING round({column}::numeric / {factor}, {settings.precision})')
+    return statements
+
+
+async def find_finer_amounts(settings: MoneySettings = setting_money) -> dict[str, int]:
+    """Число сумм точнее минимальной единицы по NUMERIC колонкам MONEY_COLUMNS"""
+    factor = 10 ** settings.precision
+    counts = {}
+    async with engine.connect() as conn:
+        for table, column in MONEY_COLUMNS:
+            counts[f'{table}.{column}'] = (await conn.execute(text(
+                f'SELECT count(*) FROM {table} WHERE {column} * {factor} <> trunc({column} * {factor})'
+            ))).scalar_one()
+    return counts
+
+
+async def convert_storage(minor_units: bool) -> list[str]:
+    """Переведет денежные колонки под minor_units одной транзакцией; вернет переведенные колонки"""
+    async with engine.begin() as conn:
+        rows = await conn.execute(text(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_schema = 'public' AND data_type = 'bigint'"
+        ))
+        bigint_columns = {(table, column) for table, column in rows} & set(MONEY_COLUMNS)
+        for statement in conversion_statements(bigint_columns, minor_units):
+            await conn.execute(text(statement))
+    return [f'{table}.{column}' for table, column in MONEY_COLUMNS
+            if ((table, column) in bigint_columns) != minor_units]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Перевод денежных колонок под MONEY_MINOR_UNITS')
+    parser.add_argument('--check', action='store_true', help='только посчитать суммы точнее минимальной единицы')
+    if parser.parse_args().check:
+        print(asyncio.run(find_finer_amounts()))
+        raise SystemExit
+    converted = asyncio.run(convert_storage(setting_money.minor_units))
+    print(f"{'bigint' if setting_money.minor_units else 'numeric'}: {', '.join(converted) or 'nothing to convert'}")
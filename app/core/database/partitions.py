@@ -0,0 +1,146 @@
+"""
+Месячные партиции таблицы payments по datetime_payment.
+
+Зачисления пишут только в партицию текущего месяца, поэтому ее индексы остаются маленькими, а история
+за последние месяцы читается из нескольких партиций. Команда обслуживания создает партиции вперед
+и выгружает старые месяцы в сжатые файлы (суммы за эти месяцы остаются в payments_daily,
+а transaction_id - в payment_transactions, поэтому повтор старого платежа все равно распознается):
+    python -m app.core.database.partitions --months-ahead 3 --keep-months 24 --archive-dir /var/backups/payments
+Запускать по cron раз в сутки; партиций на months_ahead вперед хватает, если запуск пропущен.
+Архив восстанавливается так: CREATE TABLE ... PARTITION OF payments, затем
+    gunzip -c payments_y2024m01.csv.gz | psql -c "COPY payments_y2024m01 FROM STDIN (FORMAT csv, HEADER)"
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date
+from pathlib import Path
+
+from sqlalchemy import text
+
+from app.core.config.config import engine, setting_partition
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = 'payments'
+PARTITION_NAME = re.compile(r'^payments_y(\d{4})m(\d{2})$')
+# ключ advisory блокировки: создание партиций из нескольких воркеров и cron не мешает друг другу
+PARTITION_LOCK_KEY = 0x7061796d
+
+
+def add_months(month: date, count: int) -> date:
+    """Первое число месяца, отстоящего от month на count месяцев"""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'{PARENT_TABLE}_y{month.year}m{month.month:02d}'
+
+
+def create_partition_sql(month: date) -> str:
+    """DDL партиции за месяц, начинающийся в month"""
+    return (f'CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT_TABLE} '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')")
+
+
+async def create_partitions(months_ahead: int) -> list[str]:
+    """Создаст недостающие партиции с текущего месяца на months_ahead вперед; вернет созданные"""
+    current = date.today().replace(day=1)
+    months = [add_months(current, offset) for offset in range(months_ahead + 1)]
+    async with engine.begin() as conn:
+        await conn.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': PARTITION_LOCK_KEY})
+        existing = set((await conn.execute(text(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = CAST(:parent AS regclass)'
+        ), {'parent': PARENT_TABLE})).scalars())
+        created = []
+        for month in months:
+            if partition_name(month) not in existing:
+                await conn.execute(text(create_partition_sql(month)))
+                created.append(partition_name(month))
+    return created
+
+
+async def _old_partitions(cutoff: date) -> list[tuple[str, bool, bool]]:
+    """
+    Партиции за месяцы до cutoff: (имя, подключена ли к payments, ждет ли завершения отключения).
+    Сюда попадают и отключенные, но не выгруженные таблицы, если прошлый запуск прервался.
+    """
+    async with engine.connect() as conn:
+        rows = await conn.execute(text(
+            'SELECT c.relname, i.inhrelid IS NOT NULL, coalesce(i.inhdetachpending, false) '
+            'FROM pg_class c LEFT JOIN pg_inherits i ON i.inhrelid = c.oid '
+            "WHERE c.relkind = 'r' AND c.relnamespace = 'public'::regnamespace AND c.relname ~ :pattern"
+        ), {'pattern': PARTITION_NAME.pattern})
+        partitions = []
+        for name, attached, detach_pending in rows:
+            match = PARTITION_NAME.match(name)
+            if date(int(match[1]), int(match[2]), 1) < cutoff:
+                partitions.append((name, attached, detach_pending))
+    return sorted(partitions)
+
+
+async def _export(name: str, archive_dir: Path) -> Path:
+    """Выгрузит таблицу в archive_dir/<name>.csv.gz; файл появляется под своим именем только целиком"""
+    path = archive_dir / f'{name}.csv.gz'
+    partial = path.with_suffix('.gz.part')
+    async with engine.connect() as conn:
+        expected = (await conn.execute(text(f'SELECT count(*) FROM {name}'))).scalar_one()
+        driver_connection = (await conn.get_raw_connection()).driver_connection
+        with gzip.open(partial, 'wb', compresslevel=6) as archive:
+            async def write(data: bytes) -> None:
+                archive.write(data)
+            status = await driver_connection.copy_from_table(name, output=write, format='csv', header=True)
+            archive.flush()
+            os.fsync(archive.fileobj.fileno())
+    copied = int(status.split()[-1])
+    if copied != expected:
+        raise RuntimeError(f'{name}: exported {copied} rows of {expected}')
+    os.replace(partial, path)
+    return path
+
+
+async def archive_partitions(keep_months: int, archive_dir: Path) -> list[Path]:
+    """
+    Оставит в payments keep_months последних месяцев, считая текущий. Партиции старше отключит
+    (DETACH CONCURRENTLY не блокирует зачисления), выгрузит каждую в сжатый csv и удалит таблицу.
+    Вернет пути архивов.
+    """
+    cutoff = add_months(date.today().replace(day=1), 1 - keep_months)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    archived = []
+    for name, attached, detach_pending in await _old_partitions(cutoff):
+        if attached:
+            async with engine.connect() as conn:
+                # CONCURRENTLY нельзя выполнять в транзакции
+                await conn.execution_options(isolation_level='AUTOCOMMIT')
+                mode = 'FINALIZE' if detach_pending else 'CONCURRENTLY'
+                await conn.execute(text(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name} {mode}'))
+        path = await _export(name, archive_dir)
+        async with engine.begin() as conn:
+            await conn.execute(text(f'DROP TABLE {name}'))
+        logger.info('partition %s archived to %s', name, path)
+        archived.append(path)
+    return archived
+
+
+async def maintain(months_ahead: int, keep_months: int, archive_dir: Path) -> dict[str, list[str]]:
+    created = await create_partitions(months_ahead)
+    archived = await archive_partitions(keep_months, archive_dir) if keep_months > 0 else []
+    await engine.dispose()
+    return {'created': created, 'archived': [str(path) for path in archived]}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Создание и архивирование месячных партиций payments')
+    parser.add_argument('--months-ahead', type=int, default=setting_partition.months_ahead)
+    parser.add_argument('--keep-months', type=int, default=setting_partition.keep_months,
+                        help='сколько последних месяцев оставить в БД, 0 - не архивировать')
+    parser.add_argument('--archive-dir', type=Path, default=Path(setting_partition.archive_dir))
+    args = parser.parse_args()
+    print(asyncio.run(maintain(args.months_ahead, args.keep_months, args.archive_dir)))
@@ -0,0 +1,50 @@
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.core.metrics.metrics import record_pool_wait
+
+
+class MetricsQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, который считает выдачи соединений и время ожидания свободного соединения"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+        wait = time.perf_counter() - started_at
+        self.checkouts += 1
+        self.total_wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        record_pool_wait(wait)
+        return record
+
+    def stats(self) -> dict[str, int | float]:
+        """Состояние пула: занятые, свободные и overflow соединения, ожидание выдачи"""
+        return {
+            'pool_size': self.size(),
+            'checked_out': self.checkedout(),
+            'idle': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            'max_overflow': self._max_overflow,
+            'waiting': self.waiting,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'avg_wait_seconds': self.total_wait_seconds / self.checkouts if self.checkouts else 0.0,
+            'max_wait_seconds': self.max_wait_seconds,
+        }
@@ -0,0 +1,113 @@
+import asyncio
+import functools
+import logging
+from typing import Any, Awaitable, Callable, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger(__name__)
+
+READ_ONLY = 'read_only'
+PINNED_TO_PRIMARY = 'pinned_to_primary'
+REPLICA = 'replica'
+
+T = TypeVar('T')
+
+
+class ReplicaRouter:
+    """
+    Round-robin по здоровым репликам.
+    Реплика, не ответившая на проверку, исключается до следующей успешной проверки;
+    если здоровых реплик нет, чтение идет в primary.
+    """
+
+    def __init__(self, engines: list[AsyncEngine], check_interval: float, check_timeout: float) -> None:
+        self.engines = engines
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self._healthy = list(engines)
+        self._next = 0
+        self.routed = 0
+        self.fallbacks = 0
+
+    def choose(self) -> AsyncEngine | None:
+        """Следующая здоровая реплика или None"""
+        if not self._healthy:
+            if self.engines:
+                self.fallbacks += 1
+            return None
+        self._next = (self._next + 1) % len(self._healthy)
+        self.routed += 1
+        return self._healthy[self._next]
+
+    async def _is_alive(self, engine: AsyncEngine) -> bool:
+        try:
+            async with asyncio.timeout(self.check_timeout):
+                async with engine.connect() as connection:
+                    await connection.execute(text('SELECT 1'))
+        except Exception as error:
+            logger.warning('replica %s is unavailable: %s', engine.url.render_as_string(), error)
+            return False
+        return True
+
+    async def check(self) -> None:
+        """Проверит все реплики и обновит список здоровых"""
+        alive = await asyncio.gather(*(self._is_alive(engine) for engine in self.engines))
+        self._healthy = [engine for engine, is_alive in zip(self.engines, alive) if is_alive]
+
+    async def run_health_checks(self) -> None:
+        """Проверяет реплики раз в check_interval секунд, запускается задачей в lifespan"""
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'replicas': len(self.engines),
+            'healthy': len(self._healthy),
+            'routed': self.routed,
+            'fallbacks': self.fallbacks,
+        }
+
+
+class RoutingSession(Session):
+    """
+    Сессия, которая отправляет чтения из read_only методов CRUD в реплику, а все остальное в primary.
+    После первой записи сессия закрепляется за primary до конца, чтобы запрос видел свои изменения.
+    """
+
+    def __init__(self, *args: Any, router: ReplicaRouter, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.router = router
+
+    def get_bind(self, mapper=None, clause=None, **kwargs: Any) -> Engine:
+        primary = super().get_bind(mapper, clause=clause, **kwargs)
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info[PINNED_TO_PRIMARY] = True
+            return primary
+        if not self.info.get(READ_ONLY) or self.info.get(PINNED_TO_PRIMARY):
+            return primary
+        # реплика выбирается один раз на сессию: одно соединение и согласованные чтения в запросе
+        if REPLICA not in self.info:
+            self.info[REPLICA] = self.router.choose()
+        replica = self.info[REPLICA]
+        return primary if replica is None else replica.sync_engine
+
+
+def read_only(method: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """Метод CRUD только читает: его запросы можно выполнить на реплике (первый аргумент - сессия)"""
+
+    @functools.wraps(method)
+    async def wrapper(session: AsyncSession, *args: Any, **kwargs: Any) -> T:
+        previous = session.info.get(READ_ONLY, False)
+        session.info[READ_ONLY] = True
+        try:
+            return await method(session, *args, **kwargs)
+        finally:
+            session.info[READ_ONLY] = previous
+
+    return wrapper
@@ -1,9 +1,11 @@
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
+from app.core.database.money import Money
+
 
 
 class Base(DeclarativeBase):
@@ -28,20 +30,86 @@ class ScoreSchemas(Base):
     __tablename__ = "scores"
 
     score_id: Mapped[int] = mapped_column(primary_key=True, unique=True)
-    score: Mapped[Decimal] = mapped_column(nullable=False, default=Decimal('0.0'))
-    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'))
+    score: Mapped[Decimal] = mapped_column(Money, nullable=False, default=Decimal('0.0'))
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'), index=True)
     user: Mapped["UserSchemas"] = relationship(
         back_populates="score",
     )
 
 
 class PaymentSchemas(Base):
+    """
+    Платежи, разбиты на месячные партиции по datetime_payment (см. app.core.database.partitions).
+    Уникальность transaction_id держит payment_transactions: уникальный индекс партиционированной
+    таблицы обязан включать ключ партиционирования.
+    """
     __tablename__ = 'payments'
+    __table_args__ = (
+        Index('ix_payments_user_id_datetime_payment', 'user_id', 'datetime_payment', 'payment_id'),
+        {'postgresql_partition_by': 'RANGE (datetime_payment)'},
+    )
 
-    payment_id: Mapped[int] = mapped_column(primary_key=True)
+    payment_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     score_id: Mapped[int] = mapped_column(nullable=False)
-    transaction_id: Mapped[int] = mapped_column(nullable=False, unique=True)
-    amount: Mapped[Decimal] = mapped_column(nullable=False)
+    transaction_id: Mapped[int] = mapped_column(nullable=False)
+    amount: Mapped[Decimal] = mapped_column(Money, nullable=False)
     signature: Mapped[str] = mapped_column(nullable=False)
-    datetime_payment: Mapped[datetime] = mapped_column(default=datetime.now)
+    datetime_payment: Mapped[datetime] = mapped_column(primary_key=True, default=datetime.now)
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'))
+
+
+class PaymentTransactionSchemas(Base):
+    """Обработанные transaction_id за всю историю, в том числе по выгруженным в архив партициям"""
+    __tablename__ = 'payment_transactions'
+
+    transaction_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    datetime_payment: Mapped[datetime] = mapped_column(nullable=False)
+
+
+class PaymentDailySchemas(Base):
+    """Итоги зачислений по счету за день, обновляются в транзакции зачисления"""
+    __tablename__ = 'payments_daily'
+    __table_args__ = (
+        Index('ix_payments_daily_user_id_day', 'user_id', 'day'),
+    )
+
+    score_id: Mapped[int] = mapped_column(primary_key=True)
+    day: Mapped[date] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'))
+    total_amount: Mapped[Decimal] = mapped_column(Money, nullable=False)
+    payments_count: Mapped[int] = mapped_column(nullable=False)
+    first_payment: Mapped[datetime] = mapped_column(nullable=False)
+    last_payment: Mapped[datetime] = mapped_column(nullable=False)
+
+
+class WebhookInboxSchemas(Base):
+    """Принятые вебхуки зачисления, которые ждут обработки воркером"""
+    __tablename__ = 'webhook_inbox'
+    __table_args__ = (
+        Index('ix_webhook_inbox_pending', 'available_at', postgresql_where=text("status = 'pending'")),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    transaction_id: Mapped[int] = mapped_column(nullable=False, unique=True)
+    score_id: Mapped[int] = mapped_column(nullable=False)
+    user_id: Mapped[int] = mapped_column(nullable=False)
+    amount: Mapped[Decimal] = mapped_column(Money, nullable=False)
+    signature: Mapped[str] = mapped_column(nullable=False)
+    status: Mapped[str] = mapped_column(nullable=False, default='pending')
+    attempts: Mapped[int] = mapped_column(nullable=False, default=0)
+    received_count: Mapped[int] = mapped_column(nullable=False, default=1, server_default=text('1'))
+    received_at: Mapped[datetime] = mapped_column(nullable=False, default=datetime.now)
+    available_at: Mapped[datetime] = mapped_column(nullable=False, default=datetime.now)
+    processed_at: Mapped[datetime | None]
+    result: Mapped[str | None]
+    last_error: Mapped[str | None]
+
+
+class WebhookRejectionSchemas(Base):
+    """Почасовые счетчики вебхуков, которые ничего не зачислили: повторы, неизвестный счет, неверная подпись"""
+    __tablename__ = 'webhook_rejections'
+
+    hour: Mapped[datetime] = mapped_column(primary_key=True)
+    source: Mapped[str] = mapped_column(primary_key=True)
+    reason: Mapped[str] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(nullable=False)
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from contextlib import AsyncExitStack
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from app.api.models import PaymentModel, UserModel, ScoreModel, UserPageModel, PaymentPageModel
+from app.core.config.config import engine, replica_engines, setting_database, setting_money, setting_partition
+from app.core.database.crud import UserCrud, ScoreCrud, PaymentCrud
+from app.core.database.partitions import create_partitions
+
+logger = logging.getLogger(__name__)
+
+WARMUP_PAYMENT = PaymentModel(transaction_id=0, score_id=0, user_id=0, amount=Decimal('0'), signature='')
+
+
+async def _warm_connection(connection: AsyncConnection) -> None:
+    """
+    Прогреет одно соединение: asyncpg загрузит типы, а горячие запросы попадут
+    в кеш подготовленных запросов этого соединения и в кеш компиляции SQLAlchemy.
+    """
+    await connection.execute(text('SELECT 1'))
+    session = AsyncSession(bind=connection)
+    try:
+        # счета пользователя для кешированного баланса и зачисление одним CTE; несуществующий счет
+        # ничего не зачислит, а соединение все равно откатывается
+        await ScoreCrud._load_user_scores(session, user_id=0)
+        await PaymentCrud.transfer_money(session, amount=Decimal('0'), user_id=0, score_id=0, payment=WARMUP_PAYMENT)
+        await UserCrud.get_users_page(session, limit=1)
+        await PaymentCrud.get_payments_page(session, user_id=0, limit=1)
+    finally:
+        await session.close()
+        await connection.rollback()
+
+
+def _warm_models() -> None:
+    """Прогонит горячие модели ответов через валидацию и сериализацию"""
+    now = datetime.now()
+    samples = [
+        UserModel(email='warmup@mail.ru', first_name='', last_name='', password='', state=True),
+        ScoreModel(score_id=0, score=Decimal('0')),
+        UserPageModel(items=[]),
+        PaymentPageModel(items=[], next_datetime=now, next_id=0),
+    ]
+    for sample in samples:
+        type(sample).model_validate(sample.model_dump())
+        sample.model_dump_json()
+
+
+async def _warm_engine(db_engine: AsyncEngine) -> None:
+    """Откроет pool_size соединений одновременно, прогреет каждое и вернет их в пул"""
+    async with AsyncExitStack() as stack:
+        connections = [await stack.enter_async_context(db_engine.connect())
+                       for _ in range(setting_database.pool_size)]
+        await asyncio.gather(*(_warm_connection(connection) for connection in connections))
+
+
+async def check_money_storage(db_engine: AsyncEngine) -> None:
+    """Проверит, что тип денежных колонок в БД совпадает с MONEY_MINOR_UNITS, иначе суммы читались бы в другом масштабе"""
+    expected = 'bigint' if setting_money.minor_units else 'numeric'
+    async with db_engine.connect() as connection:
+        actual = (await connection.execute(text(
+            "SELECT data_type FROM information_schema.columns WHERE table_name = 'scores' AND column_name = 'score'"
+        ))).scalar_one()
+    if actual != expected:
+        raise RuntimeError(f'scores.score is {actual}, but MONEY_MINOR_UNITS expects {expected}: '
+                           f'run python -m app.core.database.money with the same MONEY_MINOR_UNITS')
+
+
+async def warm_up() -> None:
+    """Прогреет primary и реплики; недоступная реплика не мешает готовности, ее исключит проверка здоровья"""
+    await check_money_storage(engine)
+    # без партиции текущего месяца зачисления падают, поэтому сервис не готов, пока ее нет
+    created = await create_partitions(setting_partition.months_ahead)
+    if created:
+        logger.info('payments partitions created: %s', ', '.join(created))
+    await _warm_engine(engine)
+    for replica in replica_engines:
+        try:
+            await _warm_engine(replica)
+        except (OSError, SQLAlchemyError) as error:
+            logger.warning('replica warm-up failed: %s', error)
+    _warm_models()
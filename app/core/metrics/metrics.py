@@ -0,0 +1,167 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestTimings:
+    """Время, потраченное текущим запросом на SQL, ожидание пула и хеширование"""
+    __slots__ = ('queries', 'sql_seconds', 'pool_wait_seconds', 'hashing_seconds')
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.hashing_seconds = 0.0
+
+    def server_timing(self, total_seconds: float) -> str:
+        """Значение заголовка Server-Timing, длительности в миллисекундах"""
+        return (f'total;dur={total_seconds * 1000:.2f}, '
+                f'db;dur={self.sql_seconds * 1000:.2f};desc="{self.queries} queries", '
+                f'pool;dur={self.pool_wait_seconds * 1000:.2f}, '
+                f'hash;dur={self.hashing_seconds * 1000:.2f}')
+
+
+current_timings: ContextVar[RequestTimings | None] = ContextVar('current_timings', default=None)
+
+
+def record_pool_wait(seconds: float) -> None:
+    timings = current_timings.get()
+    if timings is not None:
+        timings.pool_wait_seconds += seconds
+
+
+def record_hashing(seconds: float) -> None:
+    timings = current_timings.get()
+    if timings is not None:
+        timings.hashing_seconds += seconds
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus с набором лейблов"""
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...]) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series: dict[tuple[tuple[str, str], ...], list] = {}
+
+    def observe(self, labels: tuple[tuple[str, str], ...], value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            # счетчики по бакетам (последний - +Inf), сумма, количество
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in self._series.items():
+            label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Метрики запросов по маршрутам, хранятся в памяти воркера"""
+
+    def __init__(self) -> None:
+        self.duration = Histogram('denobank_request_duration_seconds', 'Request wall time', SECONDS_BUCKETS)
+        self.sql = Histogram('denobank_request_sql_seconds', 'SQL time per request', SECONDS_BUCKETS)
+        self.queries = Histogram('denobank_request_queries', 'SQL queries per request', COUNT_BUCKETS)
+        self.pool_wait = Histogram('denobank_request_pool_wait_seconds', 'Pool wait per request', SECONDS_BUCKETS)
+        self.hashing = Histogram('denobank_request_hashing_seconds', 'Hashing time per request', SECONDS_BUCKETS)
+        self.responses: dict[tuple[str, str, int], int] = {}
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float, timings: RequestTimings) -> None:
+        labels = (('method', method), ('route', route))
+        self.duration.observe(labels, seconds)
+        self.sql.observe(labels, timings.sql_seconds)
+        self.queries.observe(labels, timings.queries)
+        self.pool_wait.observe(labels, timings.pool_wait_seconds)
+        self.hashing.observe(labels, timings.hashing_seconds)
+        key = (method, route, status_code)
+        self.responses[key] = self.responses.get(key, 0) + 1
+
+    def render(self, gauges: dict[str, dict[str, Any]] | None = None) -> str:
+        """Все метрики в текстовом формате Prometheus; gauges - секции со статистикой вида {'db_pool': {...}}"""
+        lines = []
+        for histogram in (self.duration, self.sql, self.queries, self.pool_wait, self.hashing):
+            lines.extend(histogram.render())
+        lines.extend(['# HELP denobank_responses_total Responses by status', '# TYPE denobank_responses_total counter'])
+        for (method, route, status_code), count in self.responses.items():
+            lines.append(f'denobank_responses_total{{method="{method}",route="{route}",status="{status_code}"}} {count}')
+        for section, values in (gauges or {}).items():
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'# TYPE denobank_{section}_{key} gauge')
+                    lines.append(f'denobank_{section}_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Повесит на движок хуки, которые считают запросы и время SQL текущего HTTP запроса"""
+
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        context._metrics_started_at = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        timings = current_timings.get()
+        if timings is not None:
+            timings.queries += 1
+            timings.sql_seconds += time.perf_counter() - context._metrics_started_at
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware: считает время запроса, добавляет заголовок Server-Timing
+    и пишет гистограммы по маршруту в metrics_registry.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started_at = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                MutableHeaders(scope=message).append('Server-Timing',
+                                                     timings.server_timing(time.perf_counter() - started_at))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timings.reset(token)
+            route = scope.get('route')
+            metrics_registry.observe(scope['method'], getattr(route, 'path', 'unmatched'), status_code,
+                                     time.perf_counter() - started_at, timings)
@@ -0,0 +1,235 @@
+"""
+Воркеры очереди вебхуков зачисления (таблица webhook_inbox).
+
+Эндпоинт только сохраняет вебхук и сразу отвечает 202, а зачисляют воркеры пачками, поэтому время
+ответа платежной системе не зависит от нагрузки на БД. Воркеры запускаются в lifespan каждого процесса
+uvicorn; их можно вынести в отдельный процесс (WEBHOOK_QUEUE_WORKERS=0 у API):
+    python -m app.core.queue.queue
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.api.models import PaymentModel
+from app.core.config.config import session_maker, setting_webhook_queue, WebhookQueueSettings
+from app.core.database.crud import InboxCrud, PaymentCrud
+from app.core.database.schemas import WebhookInboxSchemas
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_ON_COMMIT = 'notify_webhook_workers'
+
+
+class WebhookWorkerPool:
+    """
+    Пул asyncio воркеров. Воркер забирает пачку событий через FOR UPDATE SKIP LOCKED и зачисляет ее
+    в той же транзакции, в которой отмечает события обработанными, поэтому событие зачисляется ровно один раз
+    даже при нескольких процессах. Подпись проверяется при приеме вебхука.
+    """
+
+    def __init__(self, settings: WebhookQueueSettings) -> None:
+        self.settings = settings
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self.batches = 0
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.errors = 0
+        self.lag_seconds = 0.0
+        self.last_batch_seconds = 0.0
+
+    def start(self) -> None:
+        """Запустит settings.workers воркеров в текущем event loop"""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.settings.workers)]
+
+    async def stop(self) -> None:
+        """Остановит воркеров; начатая пачка откатится и будет обработана заново"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        """Разбудит воркеров, чтобы не ждать poll_interval"""
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                claimed = await self.process_batch()
+            except (OSError, SQLAlchemyError) as error:
+                # БД недоступна: попытки не расходуются, события остаются в очереди
+                self.errors += 1
+                logger.warning('webhook queue worker failed, retry in %s s: %s', self.settings.poll_interval, error)
+                await asyncio.sleep(self.settings.poll_interval)
+                continue
+            except Exception:
+                # ошибка в коде не должна молча завершать задачу воркера
+                self.errors += 1
+                logger.exception('webhook queue worker crashed, retry in %s s', self.settings.poll_interval)
+                await asyncio.sleep(self.settings.poll_interval)
+                continue
+            if claimed < self.settings.batch_size:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.settings.poll_interval)
+                except TimeoutError:
+                    pass
+
+    async def process_batch(self) -> int:
+        """Обработает одну пачку событий; вернет, сколько событий было забрано"""
+        started_at = time.perf_counter()
+        async with session_maker.begin() as session:
+            events = await InboxCrud.claim_batch(session, self.settings.batch_size)
+            if not events:
+                self.lag_seconds = 0.0
+                return 0
+            self.lag_seconds = (datetime.now() - min(inbox_event.received_at for inbox_event in events)).total_seconds()
+            try:
+                await self._credit(session, events)
+            except Exception:
+                # одно плохое событие не должно отправить в dead всю пачку: повторяем по одному
+                for inbox_event in events:
+                    try:
+                        await self._credit(session, [inbox_event])
+                    except Exception as error:
+                        await self._fail(session, inbox_event, error)
+        self.batches += 1
+        self.last_batch_seconds = time.perf_counter() - started_at
+        return len(events)
+
+    async def _credit(self, session: AsyncSession, events: list[WebhookInboxSchemas]) -> None:
+        """Зачислит события в savepoint, чтобы ошибка не откатила захват пачки"""
+        payments = [PaymentModel.model_validate(inbox_event) for inbox_event in events]
+        async with session.begin_nested():
+            results = await PaymentCrud.transfer_money_batch(session, payments)
+        InboxCrud.complete(events, results)
+        self.processed += len(events)
+        self.dead_lettered += results.count('unknown score')
+
+    async def _fail(self, session: AsyncSession, inbox_event: WebhookInboxSchemas, error: Exception) -> None:
+        logger.warning('webhook %s failed on attempt %s: %s', inbox_event.transaction_id, inbox_event.attempts + 1, error)
+        if inbox_event.attempts + 1 >= self.settings.max_attempts:
+            self.dead_lettered += 1
+        else:
+            self.retried += 1
+        await InboxCrud.fail(session, [inbox_event.id], str(error),
+                             max_attempts=self.settings.max_attempts,
+                             retry_base_seconds=self.settings.retry_base_seconds,
+                             retry_max_seconds=self.settings.retry_max_seconds)
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            'workers': sum(not task.done() for task in self._tasks),
+            'batches': self.batches,
+            'processed': self.processed,
+            'retried': self.retried,
+            'dead_lettered': self.dead_lettered,
+            'errors': self.errors,
+            'lag_seconds': round(self.lag_seconds, 3),
+            'last_batch_seconds': round(self.last_batch_seconds, 3),
+        }
+
+
+class WebhookRejectionCounter:
+    """
+    Отказы вебхуков (повтор, неизвестный счет, неверная подпись) по часам, источникам и причинам.
+    Считаются в памяти процесса и сбрасываются в webhook_rejections раз в flush_seconds одним запросом,
+    поэтому отказ не пишет в БД и не ждет блокировку общей строки счетчика.
+    При падении процесса теряются отказы за последний интервал.
+    """
+
+    def __init__(self, flush_seconds: float) -> None:
+        self.flush_seconds = flush_seconds
+        self._pending: Counter[tuple[datetime, str, str]] = Counter()
+        self._totals: Counter[str] = Counter()
+        self._task: asyncio.Task | None = None
+        self.flush_errors = 0
+
+    def add(self, source: str, reasons: dict[str, int]) -> None:
+        """Учтет отказы источника source по причинам {причина: число}"""
+        hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+        for reason, count in reasons.items():
+            if count:
+                self._pending[hour, source, reason] += count
+                self._totals[reason] += count
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановит периодический сброс и сбросит то, что накопилось"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Запишет накопленные отказы; если БД недоступна, они вернутся в счетчик до следующего сброса"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, Counter()
+        try:
+            async with session_maker.begin() as session:
+                await InboxCrud.record_rejections(session, dict(pending))
+        except Exception:
+            self.flush_errors += 1
+            self._pending.update(pending)
+            logger.exception('webhook rejections flush failed, retry in %s s', self.flush_seconds)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'bad_signature': self._totals['bad signature'],
+            'duplicate': self._totals['duplicate'],
+            'unknown_score': self._totals['unknown score'],
+            'unflushed': sum(self._pending.values()),
+            'flush_errors': self.flush_errors,
+        }
+
+
+webhook_workers = WebhookWorkerPool(setting_webhook_queue)
+webhook_rejections = WebhookRejectionCounter(setting_webhook_queue.rejections_flush_seconds)
+
+
+def notify_on_commit(session: AsyncSession) -> None:
+    """Разбудит воркеров после коммита транзакции сессии, когда новое событие уже видно им"""
+    session.sync_session.info[NOTIFY_ON_COMMIT] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_after_commit(session: Session) -> None:
+    if session.info.pop(NOTIFY_ON_COMMIT, False):
+        webhook_workers.notify()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session: Session) -> None:
+    session.info.pop(NOTIFY_ON_COMMIT, None)
+
+
+async def _serve() -> None:
+    webhook_workers.start()
+    try:
+        await asyncio.gather(*webhook_workers._tasks)
+    finally:
+        await webhook_workers.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve())
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from passlib.context import CryptContext
+
+from app.core.config.config import setting_hashing, HashingSettings
+from app.core.metrics.metrics import record_hashing
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password(password: str | bytes) -> str:
+    """Вернет bcrypt хеш пароля (синхронно, выполняется в пуле)"""
+    return pwd_context.hash(password)
+
+
+def check_password(plain_password: str | bytes, hashed_password: str) -> bool:
+    """Проверит пароль по bcrypt хешу (синхронно, выполняется в пуле)"""
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class HashingService:
+    """
+    Выполняет bcrypt в отдельном пуле, чтобы не блокировать event loop.
+    Количество одновременных хешей ограничено семафором, остальные запросы ждут в очереди.
+    """
+
+    def __init__(self, settings: HashingSettings) -> None:
+        self.settings = settings
+        self._executor: Executor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.total = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_hash_seconds = 0.0
+
+    def _get_executor(self) -> Executor:
+        """Создаст пул при первом обращении, чтобы он появлялся уже в воркере"""
+        if self._executor is None:
+            if self.settings.executor == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.settings.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.settings.max_workers,
+                                                    thread_name_prefix='hashing')
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.settings.max_concurrency)
+        return self._semaphore
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Выполнит func в пуле с учетом лимита одновременных вызовов"""
+        semaphore = self._get_semaphore()
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started_at = time.perf_counter()
+        wait = started_at - queued_at
+        self.total_wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.in_flight -= 1
+            self.total += 1
+            elapsed = time.perf_counter() - started_at
+            self.total_hash_seconds += elapsed
+            record_hashing(elapsed)
+            semaphore.release()
+
+    async def hash(self, password: str | bytes) -> str:
+        """Вернет хеш пароля, не блокируя event loop"""
+        return await self.run(hash_password, password)
+
+    async def verify(self, plain_password: str | bytes, hashed_password: str) -> bool:
+        """Проверит пароль, не блокируя event loop"""
+        return await self.run(check_password, plain_password, hashed_password)
+
+    def stats(self) -> dict[str, int | float | str]:
+        """Метрики очереди хеширования"""
+        return {
+            'executor': self.settings.executor,
+            'max_workers': self.settings.max_workers,
+            'max_concurrency': self.settings.max_concurrency,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'total': self.total,
+            'avg_wait_seconds': self.total_wait_seconds / self.total if self.total else 0.0,
+            'max_wait_seconds': self.max_wait_seconds,
+            'avg_hash_seconds': self.total_hash_seconds / self.total if self.total else 0.0,
+        }
+
+    def reset_after_fork(self) -> None:
+        """Забудет пул и семафор, унаследованные от родительского процесса"""
+        self._executor = None
+        self._semaphore = None
+
+    def shutdown(self) -> None:
+        """Остановит пул"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._semaphore = None
+
+
+hashing_service = HashingService(setting_hashing)
+
+# пул потоков и семафор родителя не переживают fork, в дочернем процессе они создадутся заново
+os.register_at_fork(after_in_child=hashing_service.reset_after_fork)
@@ -0,0 +1,115 @@
+import math
+import time
+from abc import ABC, abstractmethod
+
+from app.core.config.config import setting_rate_limit, RateLimitSettings
+
+
+class RateLimitBackend(ABC):
+    """
+    Хранилище счетчиков лимитера. В памяти процесса - InMemorySlidingWindow;
+    для общего лимита на все воркеры можно реализовать тот же интерфейс поверх внешнего хранилища.
+    """
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int) -> float:
+        """Засчитает попытку по ключу и вернет 0; если лимит исчерпан - не засчитает и вернет, сколько секунд ждать"""
+
+    @abstractmethod
+    def stats(self) -> dict[str, int]:
+        """Размер хранилища"""
+
+
+class InMemorySlidingWindow(RateLimitBackend):
+    """
+    Скользящее окно по двум соседним фиксированным окнам: на ключ хранятся номер окна
+    и счетчики текущего и предыдущего окна, предыдущее учитывается с весом оставшейся доли.
+    Устаревшие ключи удаляются не чаще раза в окно, общее число ключей ограничено max_keys.
+    """
+
+    def __init__(self, window_seconds: float, max_keys: int) -> None:
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._counters: dict[str, list[int]] = {}
+        self._evicted_at = 0
+        self.evictions = 0
+
+    async def hit(self, key: str, limit: int) -> float:
+        now = time.monotonic()
+        window = math.floor(now / self.window_seconds)
+        if window > self._evicted_at:
+            self._evict(window)
+
+        counter = self._counters.get(key)
+        if counter is None:
+            if len(self._counters) >= self.max_keys:
+                # словарь хранит порядок добавления, первым идет самый давний ключ
+                del self._counters[next(iter(self._counters))]
+                self.evictions += 1
+            counter = self._counters[key] = [window, 0, 0]
+        elif counter[0] != window:
+            counter[2] = counter[1] if counter[0] == window - 1 else 0
+            counter[1] = 0
+            counter[0] = window
+
+        elapsed = now / self.window_seconds - window
+        if counter[2] * (1 - elapsed) + counter[1] + 1 > limit:
+            return (1 - elapsed) * self.window_seconds
+        counter[1] += 1
+        return 0.0
+
+    def _evict(self, window: int) -> None:
+        """Удалит ключи, по которым не было попыток ни в текущем, ни в предыдущем окне"""
+        stale = [key for key, counter in self._counters.items() if counter[0] < window - 1]
+        for key in stale:
+            del self._counters[key]
+        self.evictions += len(stale)
+        self._evicted_at = window
+
+    def stats(self) -> dict[str, int]:
+        return {'keys': len(self._counters), 'max_keys': self.max_keys, 'evictions': self.evictions}
+
+
+class LoginRateLimiter:
+    """Лимит попыток входа по email и по ip клиента, проверяется до запроса в БД и bcrypt"""
+
+    def __init__(self, settings: RateLimitSettings, backend: RateLimitBackend) -> None:
+        self.settings = settings
+        self.backend = backend
+        self.allowed = 0
+        self.rejected_by_ip = 0
+        self.rejected_by_email = 0
+
+    async def hit(self, email: str, ip: str | None) -> float:
+        """Засчитает попытку входа; вернет 0 или сколько секунд клиенту ждать"""
+        if not self.settings.enabled:
+            return 0.0
+        if ip is not None:
+            retry_after = await self.backend.hit(f'ip:{ip}', self.settings.login_per_ip)
+            if retry_after:
+                self.rejected_by_ip += 1
+                return retry_after
+        retry_after = await self.backend.hit(f'email:{email.lower()}', self.settings.login_per_email)
+        if retry_after:
+            self.rejected_by_email += 1
+            return retry_after
+        self.allowed += 1
+        return 0.0
+
+    def stats(self) -> dict[str, int | float | bool]:
+        return {
+            'enabled': self.settings.enabled,
+            'login_per_email': self.settings.login_per_email,
+            'login_per_ip': self.settings.login_per_ip,
+            'window_seconds': self.settings.window_seconds,
+            'allowed': self.allowed,
+            'rejected_by_ip': self.rejected_by_ip,
+            'rejected_by_email': self.rejected_by_email,
+            **self.backend.stats(),
+        }
+
+
+login_rate_limiter = LoginRateLimiter(
+    setting_rate_limit,
+    InMemorySlidingWindow(window_seconds=setting_rate_limit.window_seconds, max_keys=setting_rate_limit.max_keys),
+)
@@ -0,0 +1,49 @@
+import time
+
+from app.core.config.config import setting_access_token
+
+
+class TokenRevocations:
+    """
+    Отзыв stateless access токенов в памяти процесса.
+    Для email хранится время отзыва: токен, выданный не позже (claim ver), не принимается.
+    Запись живет, пока живы токены, выданные до отзыва, поэтому таблица остается маленькой.
+    """
+
+    def __init__(self, ttl_seconds: float) -> None:
+        self.ttl_seconds = ttl_seconds
+        self._revoked_at: dict[str, float] = {}
+        self.revocations = 0
+        self.rejected = 0
+
+    def invalidate(self, *emails: str) -> None:
+        """Отзовет все токены пользователей, выданные до этого момента"""
+        now = time.time()
+        self._purge(now)
+        for email in emails:
+            self._revoked_at[email] = now
+        self.revocations += len(emails)
+
+    def is_revoked(self, email: str, version: float) -> bool:
+        """Проверит, отозван ли токен с версией version (время выдачи)"""
+        revoked_at = self._revoked_at.get(email)
+        if revoked_at is not None and version <= revoked_at:
+            self.rejected += 1
+            return True
+        return False
+
+    def _purge(self, now: float) -> None:
+        """Забудет отзывы, после которых все выданные раньше токены уже истекли"""
+        expired_before = now - self.ttl_seconds
+        for email in [email for email, revoked_at in self._revoked_at.items() if revoked_at < expired_before]:
+            del self._revoked_at[email]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': len(self._revoked_at),
+            'revocations': self.revocations,
+            'rejected': self.rejected,
+        }
+
+
+token_revocations = TokenRevocations(ttl_seconds=setting_access_token.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
@@ -0,0 +1,78 @@
+import hashlib
+import hmac
+from typing import Iterable
+
+from app.api.models import PaymentModel
+from app.core.config.config import setting_check_sig
+
+# Поля подписи в алфавитном порядке ключей платежной системы:
+# account_id (у нас score_id), amount, transaction_id, user_id
+SIGNED_FIELDS = ('score_id', 'amount', 'transaction_id', 'user_id')
+
+
+def signature_message(payment: PaymentModel) -> bytes:
+    """Вернет строку для подписи: конкатенация значений полей"""
+    return ''.join(str(getattr(payment, field)) for field in SIGNED_FIELDS).encode()
+
+
+class SignatureVerifier:
+    """
+    Проверка подписи вебхука через HMAC-SHA256.
+    Принимает несколько ключей для ротации: подписывает текущим, проверяет всеми.
+    accept_sha256 - принимать и подписи по схеме спецификации платежной системы sha256({поля}{ключ}),
+    пока интеграции не перешли на HMAC.
+    """
+
+    def __init__(self, secret_keys: Iterable[str], accept_sha256: bool = False) -> None:
+        keys = [key.encode() for key in secret_keys if key]
+        if not keys:
+            raise ValueError('at least one webhook secret key is required')
+        self._macs = [hmac.new(key, digestmod=hashlib.sha256) for key in keys]
+        self._sha256_keys = keys if accept_sha256 else []
+
+    def _digest(self, mac: hmac.HMAC, message: bytes) -> bytes:
+        mac = mac.copy()
+        mac.update(message)
+        return mac.hexdigest().encode()
+
+    def sign(self, payment: PaymentModel) -> str:
+        """Вернет подпись платежа текущим ключом"""
+        return self._digest(self._macs[0], signature_message(payment)).decode()
+
+    def verify(self, payment: PaymentModel) -> bool:
+        """Проверит подпись платежа за постоянное время по всем действующим ключам"""
+        message = signature_message(payment)
+        signature = payment.signature.strip().lower().encode()
+        valid = False
+        for mac in self._macs:
+            valid |= hmac.compare_digest(self._digest(mac, message), signature)
+        for key in self._sha256_keys:
+            valid |= hmac.compare_digest(hashlib.sha256(message + key).hexdigest().encode(), signature)
+        return valid
+
+
+signature_verifier = SignatureVerifier(setting_check_sig.active_secret_keys(),
+                                       accept_sha256=setting_check_sig.ACCEPT_SHA256_SIGNATURES)
+
+
+if __name__ == '__main__':
+    # микро-бенчмарк: HMAC-SHA256 против прежней проверки через два bcrypt
+    import timeit
+    from decimal import Decimal
+
+    from app.core.security.hashing import hash_password, check_password
+
+    payment = PaymentModel(transaction_id=3, score_id=1, user_id=1, amount=Decimal('55'), signature='')
+    payment.signature = signature_verifier.sign(payment)
+    print(f'signature: {payment.signature}')
+
+    def bcrypt_path():
+        concatenated_string = signature_message(payment) + setting_check_sig.SECRET_KEY.encode()
+        check_password(payment.signature, hash_password(concatenated_string))
+
+    hmac_runs, bcrypt_runs = 100_000, 5
+    hmac_time = timeit.timeit(lambda: signature_verifier.verify(payment), number=hmac_runs) / hmac_runs
+    bcrypt_time = timeit.timeit(bcrypt_path, number=bcrypt_runs) / bcrypt_runs
+    print(f'hmac:   {hmac_time * 1e6:10.2f} us/check')
+    print(f'bcrypt: {bcrypt_time * 1e6:10.2f} us/check')
+    print(f'speedup: x{bcrypt_time / hmac_time:.0f}')
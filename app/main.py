@@ -1,17 +1,71 @@
+import asyncio
+import logging
 from contextlib import asynccontextmanager
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy.exc import SQLAlchemyError
 
 from api import users_router, auth_router, admin_router, wallet_router
+from app.core.cache.cache import balance_cache, principal_cache, token_cache
+from app.core.config.config import setting_server, engine, replica_engines, replica_router
+from app.core.database.warmup import warm_up
+from app.core.metrics.metrics import TimingMiddleware, metrics_registry
+from app.core.queue.queue import webhook_rejections, webhook_workers
+from app.core.security.hashing import hashing_service
+from app.core.security.ratelimit import login_rate_limiter
+from app.core.security.revocation import token_revocations
+
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_up_until_ready(app: FastAPI, retry_seconds: float = 5.0) -> None:
+    """Повторяет прогрев, пока БД недоступна; после успеха /ready отвечает 200"""
+    while True:
+        try:
+            await warm_up()
+        except (OSError, SQLAlchemyError) as error:
+            logger.warning('warm-up failed, retry in %s s: %s', retry_seconds, error)
+            await asyncio.sleep(retry_seconds)
+        except RuntimeError as error:
+            # БД доступна, но не готова к работе (например, другой масштаб денежных колонок)
+            logger.error('warm-up failed, retry in %s s: %s', retry_seconds, error)
+            await asyncio.sleep(retry_seconds)
+        else:
+            app.state.ready = True
+            return
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    app.state.ready = False
+    try:
+        await warm_up()
+        app.state.ready = True
+        retry_task = None
+    except (OSError, SQLAlchemyError) as error:
+        # сервер все равно стартует, но /ready не станет зеленым, пока прогрев не пройдет
+        logger.warning('warm-up failed, serving as not ready: %s', error)
+        retry_task = asyncio.create_task(warm_up_until_ready(app))
+    health_task = asyncio.create_task(replica_router.run_health_checks()) if replica_engines else None
+    webhook_workers.start()
+    webhook_rejections.start()
     yield
+    await webhook_workers.stop()
+    await webhook_rejections.stop()
+    if retry_task is not None:
+        retry_task.cancel()
+    if health_task is not None:
+        health_task.cancel()
+    hashing_service.shutdown()
+    for db_engine in [engine, *replica_engines]:
+        await db_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(TimingMiddleware)
 
 app.include_router(users_router)
 app.include_router(auth_router)
@@ -24,5 +78,56 @@ async def main():
     return {'msg': 'main'}
 
 
+@app.get('/ready', tags=['Main'])
+async def ready(request: Request) -> JSONResponse:
+    """Readiness: 200 только после прогрева пула и кешей"""
+    if request.app.state.ready:
+        return JSONResponse({'status': 'ready'})
+    return JSONResponse({'status': 'warming up'}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@app.get('/metrics', tags=['Main'], include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    """Метрики этого воркера в формате Prometheus: время по маршрутам, SQL, пул, хеширование"""
+    body = metrics_registry.render(gauges={
+        'db_pool': engine.pool.stats(),
+        'db_replicas': replica_router.stats(),
+        'hashing': hashing_service.stats(),
+        'principal_cache': principal_cache.stats(),
+        'balance_cache': balance_cache.stats(),
+        'token_cache': token_cache.stats(),
+        'token_revocations': token_revocations.stats(),
+        'login_rate_limit': login_rate_limiter.stats(),
+        'webhook_queue': webhook_workers.stats(),
+        'webhook_rejections': webhook_rejections.stats(),
+    })
+    return PlainTextResponse(body, media_type='text/plain; version=0.0.4')
+
+
+def run() -> None:
+    """
+    dev - один процесс с reload.
+    prod - несколько воркеров uvicorn; каждый воркер - отдельный процесс (spawn),
+    поэтому engine и пул соединений создаются в каждом воркере свои.
+    """
+    if setting_server.mode == 'dev':
+        uvicorn.run('main:app', reload=True, host=setting_server.host, port=setting_server.port)
+        return
+    uvicorn.run(
+        'main:app',
+        host=setting_server.host,
+        port=setting_server.port,
+        workers=setting_server.worker_count(),
+        loop=setting_server.loop,
+        http=setting_server.http,
+        timeout_keep_alive=setting_server.keep_alive,
+        backlog=setting_server.backlog,
+        timeout_graceful_shutdown=setting_server.graceful_timeout,
+        limit_max_requests=setting_server.limit_max_requests or None,
+        proxy_headers=True,
+        access_log=setting_server.access_log,
+    )
+
+
 if __name__ == '__main__':
-    uvicorn.run('main:app', reload=True, host='0.0.0.0')
+    run()
@@ -0,0 +1,63 @@
+"""
+Микробенчмарк кеша разбора jwt (decode_token) против jwt.decode на каждый запрос.
+
+Клиенты присылают один и тот же access токен много раз, поэтому моделируется --tokens активных токенов,
+по которым идут --calls проверок по кругу. Печатается json с CPU временем на одну проверку
+и сэкономленной долей ядра при заданном --rps. БД не нужна.
+    SECRET_KEY=bench python -m benchmarks.token_cache --tokens 1000 --calls 200000 --rps 5000
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import jwt
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / 'app'))
+
+from app.api.depends.depends import create_access_token, decode_token  # noqa: E402
+from app.core.cache.cache import token_cache  # noqa: E402
+from app.core.config.config import setting_access_token  # noqa: E402
+
+
+def measure(decode, tokens: list[str], calls: int) -> float:
+    """CPU секунды на один вызов decode"""
+    started_at = time.process_time()
+    for number in range(calls):
+        decode(tokens[number % len(tokens)])
+    return (time.process_time() - started_at) / calls
+
+
+def main(args: argparse.Namespace) -> dict:
+    tokens = [create_access_token({'sub': f'bench{number}@mail.ru', 'type': 'access'},
+                                  expires_delta=timedelta(minutes=setting_access_token.ACCESS_TOKEN_EXPIRE_MINUTES))
+              for number in range(args.tokens)]
+
+    def uncached(token: str) -> dict:
+        return jwt.decode(token, setting_access_token.SECRET_KEY, algorithms=[setting_access_token.ALGORITHM])
+
+    token_cache.clear()
+    uncached_seconds = measure(uncached, tokens, args.calls)
+    cached_seconds = measure(decode_token, tokens, args.calls)
+    saved = uncached_seconds - cached_seconds
+    return {
+        'tokens': args.tokens,
+        'calls': args.calls,
+        'jwt_decode_us': round(uncached_seconds * 1e6, 2),
+        'decode_token_us': round(cached_seconds * 1e6, 2),
+        'speedup': round(uncached_seconds / cached_seconds, 1) if cached_seconds else None,
+        'rps': args.rps,
+        'cpu_core_saved': round(saved * args.rps, 3),
+        'cache': token_cache.stats(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк кеша разбора jwt')
+    parser.add_argument('--tokens', type=int, default=1000, help='сколько разных токенов в обращении')
+    parser.add_argument('--calls', type=int, default=200_000)
+    parser.add_argument('--rps', type=int, default=5000, help='для пересчета в долю ядра')
+    print(json.dumps(main(parser.parse_args()), indent=2))
@@ -8,6 +8,7 @@ from sqlalchemy.ext.asyncio import async_engine_from_config
 from alembic import context
 
 from app.core.config.config import setting_database
+from app.core.database.partitions import PARTITION_NAME
 from app.core.database.schemas import Base, UserSchemas # noqa
 
 # this is the Alembic Config object, which provides
@@ -27,6 +28,11 @@ config.set_main_option('sqlalchemy.url', setting_database.url)
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+
+def include_name(name, type_, parent_names) -> bool:
+    """Месячные партиции payments создаются командой обслуживания, а не миграциями"""
+    return not (type_ == 'table' and PARTITION_NAME.match(name))
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -51,7 +57,8 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
-        compare_server_default=True
+        compare_server_default=True,
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -59,7 +66,7 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata, include_name=include_name)
 
     with context.begin_transaction():
         context.run_migrations()
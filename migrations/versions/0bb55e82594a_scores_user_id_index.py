@@ -0,0 +1,28 @@
+"""scores user_id index
+
+Revision ID: 0bb55e82594a
+Revises: 9005abec6dad
+Create Date: 2026-10-18 10:37:27.729655
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0bb55e82594a'
+down_revision: Union[str, None] = '9005abec6dad'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_scores_user_id'), 'scores', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_scores_user_id'), table_name='scores')
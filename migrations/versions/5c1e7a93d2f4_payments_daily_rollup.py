@@ -0,0 +1,40 @@
+"""payments daily rollup
+
+Revision ID: 5c1e7a93d2f4
+Revises: 0bb55e82594a
+Create Date: 2026-10-18 16:12:04.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e7a93d2f4'
+down_revision: Union[str, None] = '0bb55e82594a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('payments_daily',
+    sa.Column('score_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('total_amount', sa.Numeric(), nullable=False),
+    sa.Column('payments_count', sa.Integer(), nullable=False),
+    sa.Column('first_payment', sa.DateTime(), nullable=False),
+    sa.Column('last_payment', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('score_id', 'day')
+    )
+    op.create_index('ix_payments_daily_user_id_day', 'payments_daily', ['user_id', 'day'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_payments_daily_user_id_day', table_name='payments_daily')
+    op.drop_table('payments_daily')
@@ -0,0 +1,47 @@
+"""webhook inbox
+
+Revision ID: 8e2b4f0c6a17
+Revises: 5c1e7a93d2f4
+Create Date: 2026-10-18 17:40:51.902336
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2b4f0c6a17'
+down_revision: Union[str, None] = '5c1e7a93d2f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('webhook_inbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('transaction_id', sa.Integer(), nullable=False),
+    sa.Column('score_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Numeric(), nullable=False),
+    sa.Column('signature', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('received_at', sa.DateTime(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.Column('result', sa.String(), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('transaction_id')
+    )
+    op.create_index('ix_webhook_inbox_pending', 'webhook_inbox', ['available_at'], unique=False,
+                    postgresql_where=sa.text("status = 'pending'"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_webhook_inbox_pending', table_name='webhook_inbox', postgresql_where=sa.text("status = 'pending'"))
+    op.drop_table('webhook_inbox')
@@ -0,0 +1,29 @@
+"""payments history index
+
+Revision ID: 9005abec6dad
+Revises: f586a4f056f6
+Create Date: 2026-10-18 10:34:21.145221
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9005abec6dad'
+down_revision: Union[str, None] = 'f586a4f056f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_payments_user_id_datetime_payment', 'payments',
+                    ['user_id', 'datetime_payment', 'payment_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_payments_user_id_datetime_payment', table_name='payments')
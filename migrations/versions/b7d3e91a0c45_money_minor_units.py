@@ -0,0 +1,44 @@
+"""money minor units
+
+Revision ID: b7d3e91a0c45
+Revises: 8e2b4f0c6a17
+Create Date: 2026-10-18 19:05:13.558921
+
+Переводит денежные колонки в BIGINT минимальных единиц, только если MONEY_MINOR_UNITS=true.
+Без этого ревизия ничего не меняет; downgrade возвращает NUMERIC, если колонки были переведены.
+Перейти в другой режим после миграции - командой python -m app.core.database.money.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.config.config import setting_money
+from app.core.database.money import MONEY_COLUMNS, conversion_statements
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d3e91a0c45'
+down_revision: Union[str, None] = '8e2b4f0c6a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _bigint_columns() -> set[tuple[str, str]]:
+    inspector = sa.inspect(op.get_bind())
+    return {(table, column['name']) for table, _ in MONEY_COLUMNS for column in inspector.get_columns(table)
+            if isinstance(column['type'], sa.BigInteger)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not setting_money.minor_units:
+        return
+    for statement in conversion_statements(_bigint_columns(), minor_units=True):
+        op.execute(sa.text(statement))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for statement in conversion_statements(_bigint_columns(), minor_units=False):
+        op.execute(sa.text(statement))
@@ -0,0 +1,80 @@
+"""payments partitions
+
+Revision ID: d4a8c2e61f93
+Revises: b7d3e91a0c45
+Create Date: 2026-10-18 21:12:40.318207
+
+Пересоздает payments как таблицу с месячными партициями по datetime_payment и переносит в нее данные.
+Глобальная уникальность transaction_id переезжает в payment_transactions.
+Downgrade возвращает обычную таблицу; строки из партиций, уже выгруженных в архив, в нее не попадают.
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.config.config import setting_partition
+from app.core.database.partitions import add_months, create_partition_sql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a8c2e61f93'
+down_revision: Union[str, None] = 'b7d3e91a0c45'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = 'payment_id, score_id, transaction_id, amount, signature, datetime_payment, user_id'
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('payment_transactions',
+    sa.Column('transaction_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('datetime_payment', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('transaction_id')
+    )
+    op.execute('INSERT INTO payment_transactions (transaction_id, datetime_payment) '
+               'SELECT transaction_id, datetime_payment FROM payments')
+
+    op.rename_table('payments', 'payments_unpartitioned')
+    op.execute('CREATE TABLE payments (LIKE payments_unpartitioned INCLUDING DEFAULTS) '
+               'PARTITION BY RANGE (datetime_payment)')
+
+    first, last = op.get_bind().execute(sa.text(
+        'SELECT min(datetime_payment), max(datetime_payment) FROM payments_unpartitioned'
+    )).one()
+    current = date.today().replace(day=1)
+    month = min(first.date().replace(day=1), current) if first else current
+    last_month = add_months(current, setting_partition.months_ahead)
+    if last and last.date().replace(day=1) > last_month:
+        last_month = last.date().replace(day=1)
+    while month <= last_month:
+        op.execute(create_partition_sql(month))
+        month = add_months(month, 1)
+
+    op.execute(f'INSERT INTO payments ({COLUMNS}) SELECT {COLUMNS} FROM payments_unpartitioned')
+    op.execute('ALTER SEQUENCE payments_payment_id_seq OWNED BY payments.payment_id')
+    op.drop_table('payments_unpartitioned')
+
+    # индексы строятся после загрузки данных, по каждой партиции
+    op.create_primary_key('payments_pkey', 'payments', ['payment_id', 'datetime_payment'])
+    op.create_foreign_key('payments_user_id_fkey', 'payments', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+    op.create_index('ix_payments_user_id_datetime_payment', 'payments',
+                    ['user_id', 'datetime_payment', 'payment_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.rename_table('payments', 'payments_partitioned')
+    op.execute('CREATE TABLE payments (LIKE payments_partitioned INCLUDING DEFAULTS)')
+    op.execute(f'INSERT INTO payments ({COLUMNS}) SELECT {COLUMNS} FROM payments_partitioned')
+    op.execute('ALTER SEQUENCE payments_payment_id_seq OWNED BY payments.payment_id')
+    op.drop_table('payments_partitioned')
+
+    op.create_primary_key('payments_pkey', 'payments', ['payment_id'])
+    op.create_unique_constraint('payments_transaction_id_key', 'payments', ['transaction_id'])
+    op.create_foreign_key('payments_user_id_fkey', 'payments', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+    op.create_index('ix_payments_user_id_datetime_payment', 'payments',
+                    ['user_id', 'datetime_payment', 'payment_id'], unique=False)
+    op.drop_table('payment_transactions')
@@ -0,0 +1,36 @@
+"""webhook receipts
+
+Revision ID: e6f1a9b3c2d8
+Revises: d4a8c2e61f93
+Create Date: 2026-10-18 22:31:07.664120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6f1a9b3c2d8'
+down_revision: Union[str, None] = 'd4a8c2e61f93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('webhook_inbox', sa.Column('received_count', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.create_table('webhook_rejections',
+    sa.Column('hour', sa.DateTime(), nullable=False),
+    sa.Column('source', sa.String(), nullable=False),
+    sa.Column('reason', sa.String(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('hour', 'source', 'reason')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('webhook_rejections')
+    op.drop_column('webhook_inbox', 'received_count')